@@ -2,6 +2,13 @@
 ASGI config for CHD project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The websocket stream and the async/long-poll views need an ASGI server, from
+backend/CHD run:
+
+    uvicorn CHD.asgi:application --host 0.0.0.0 --port 8000
+
+``manage.py runserver`` is WSGI only: it can't serve websockets and holds a
+thread for the whole of every long poll.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -13,4 +20,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "CHD.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Import after Django is set up, the consumers touch the ORM
+from api.consumers import conversation_socket  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # Django only speaks HTTP (including the async chat views under /api/async/);
+    # websocket connections go to the live message stream
+    if scope["type"] == "websocket":
+        return await conversation_socket(scope, receive, send)
+    return await django_application(scope, receive, send)
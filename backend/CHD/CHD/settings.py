@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -71,14 +72,83 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "CHD.wsgi.application"
 
+ASGI_APPLICATION = "CHD.asgi.application"
+
+# Pub/sub backend used to push new messages to websocket clients
+MESSAGE_BROKER = "api.broker.InProcessBroker"
+
+# Event listings return upcoming events up to this many days ahead, clients may ask for less
+EVENT_HORIZON_DAYS = 365
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
+# Configured from the environment:
+#   CHD_DB_ENGINE   "sqlite" (default) or "postgres" (requires psycopg)
+#   CHD_DB_NAME     database name, or the file path for SQLite
+#   CHD_DB_USER, CHD_DB_PASSWORD, CHD_DB_HOST, CHD_DB_PORT   server credentials
+#   CHD_DB_CONN_MAX_AGE   seconds a server connection is reused (default 60)
+#   CHD_DB_POOL     "1" to use psycopg's connection pool instead of persistent connections
+#   CHD_DB_WAL      "1" to switch a SQLite database to WAL journaling (persists in the file)
+
+DB_ENGINE = os.environ.get("CHD_DB_ENGINE", "sqlite")
+
+if DB_ENGINE == "postgres":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("CHD_DB_NAME", "chd"),
+            "USER": os.environ.get("CHD_DB_USER", ""),
+            "PASSWORD": os.environ.get("CHD_DB_PASSWORD", ""),
+            "HOST": os.environ.get("CHD_DB_HOST", ""),
+            "PORT": os.environ.get("CHD_DB_PORT", ""),
+            "CONN_MAX_AGE": int(os.environ.get("CHD_DB_CONN_MAX_AGE", 60)),
+            # Check reused connections before handing them to a request
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {},
+        }
+    }
+    if os.environ.get("CHD_DB_POOL") == "1":
+        # The pool replaces persistent connections, Django refuses to combine them
+        DATABASES["default"]["CONN_MAX_AGE"] = 0
+        DATABASES["default"]["OPTIONS"]["pool"] = True
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("CHD_DB_NAME", BASE_DIR / "db.sqlite3"),
+            "OPTIONS": {
+                # Wait up to 20s for a lock instead of failing with "database is locked"
+                "timeout": 20,
+                # Take the write lock when the transaction starts, so writers queue instead of deadlocking
+                "transaction_mode": "IMMEDIATE",
+                "init_command": (
+                    "PRAGMA busy_timeout=20000;"
+                    "PRAGMA mmap_size=134217728;"
+                ),
+            },
+        }
+    }
+    if os.environ.get("CHD_DB_WAL") == "1":
+        # WAL lets readers run alongside the writer, NORMAL sync is safe under WAL.
+        # The journal mode is stored in the database file, so it stays opt-in to keep the committed db.sqlite3 as is
+        DATABASES["default"]["OPTIONS"]["init_command"] = (
+            "PRAGMA journal_mode=WAL;"
+            "PRAGMA synchronous=NORMAL;"
+        ) + DATABASES["default"]["OPTIONS"]["init_command"]
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Local memory by default; point CHD_CACHE_BACKEND at e.g.
+# django.core.cache.backends.filebased.FileBasedCache (with CHD_CACHE_LOCATION set to a
+# directory) to share cached responses and their invalidations between worker processes.
+
+CACHES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "BACKEND": os.environ.get("CHD_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("CHD_CACHE_LOCATION", "chd"),
     }
 }
 
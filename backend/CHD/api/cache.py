@@ -0,0 +1,76 @@
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+from .conditional import make_etag, query_fingerprint, etag_matches, set_validators, not_modified
+
+
+RESPONSE_TIMEOUT = 60 * 10
+PROFILE_TIMEOUT = 60 * 60
+
+
+# Cached entries embed their namespace's version in the key, so bumping the
+# version invalidates every entry of the namespace at once without a scan.
+
+def get_version(namespace):
+    key = f"version:{namespace}"
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def bump_version(namespace):
+    key = f"version:{namespace}"
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Nothing cached under this namespace yet (or the version was evicted)
+        cache.add(key, 1, timeout=None)
+        return cache.incr(key)
+
+
+def versioned_key(namespace, *parts):
+    return ":".join([namespace, str(get_version(namespace)), *map(str, parts)])
+
+
+def cached_response(request, namespace, build, timeout=RESPONSE_TIMEOUT, key_parts=()):
+    """
+    Serve the data returned by build() from the cache, keyed by path and query string.
+
+    `key_parts` adds anything else the data depends on, such as a time window. The ETag
+    is derived from the versioned key, so a client holding the current version gets a
+    304 without the data being loaded at all.
+    """
+    key = versioned_key(namespace, "response", request.path, query_fingerprint(request), *key_parts)
+    etag = make_etag(key, request.accepted_media_type)
+
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, timeout=timeout)
+
+    return set_validators(Response(data, status=status.HTTP_200_OK), etag)
+
+
+def profile_key(user_id):
+    return f"profile:{user_id}"
+
+
+def get_profile(user_id, build, timeout=PROFILE_TIMEOUT):
+    """Cached user profile (user fields and current home), built on a miss unless build() returns None."""
+    key = profile_key(user_id)
+    profile = cache.get(key)
+    if profile is None:
+        profile = build()
+        if profile is not None:
+            cache.set(key, profile, timeout=timeout)
+    return profile
+
+
+def invalidate_profile(user_id):
+    cache.delete(profile_key(user_id))
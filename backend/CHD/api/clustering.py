@@ -0,0 +1,114 @@
+import math
+
+from django.core.cache import cache
+from django.db.models import Avg, Count, F, IntegerField, Max, Min, Value
+from django.db.models.functions import Floor, Least
+
+from . import geo
+from .cache import versioned_key
+
+
+# At zoom z the world is cut into square tiles of 360 / 2**z degrees, and every tile
+# into CLUSTERS_PER_TILE x CLUSTERS_PER_TILE cluster cells. Tiles are the cache unit.
+MAX_ZOOM = 20
+CLUSTERS_PER_TILE = 8
+MAX_TILES = 64
+TILE_TIMEOUT = 60 * 60
+
+
+def tile_size(zoom):
+    return 360 / 2 ** zoom
+
+
+def covering_tiles(zoom, min_lat, max_lat, min_lng, max_lng):
+    """(x, y) of every tile overlapping the viewport, or None if there are more than MAX_TILES."""
+    size = tile_size(zoom)
+    columns, rows = math.ceil(360 / size), math.ceil(180 / size)
+
+    def column(longitude):
+        return min(math.floor((longitude + 180) / size), columns - 1)
+
+    def row(latitude):
+        return min(math.floor((latitude + 90) / size), rows - 1)
+
+    if min_lng <= max_lng:
+        xs = list(range(column(min_lng), column(max_lng) + 1))
+    else:
+        xs = list(range(column(min_lng), columns)) + list(range(0, column(max_lng) + 1))
+    ys = range(row(min_lat), row(max_lat) + 1)
+
+    if len(xs) * len(ys) > MAX_TILES:
+        return None
+    return [(x, y) for y in ys for x in xs]
+
+
+def tile_clusters(queryset, zoom, x, y, prefix=""):
+    """Aggregate the rows of `queryset` that fall into tile (x, y) into cluster cells."""
+    size = tile_size(zoom)
+    cell = size / CLUSTERS_PER_TILE
+    lat_field, lng_field = f"{prefix}latitude", f"{prefix}longitude"
+
+    min_lat, min_lng = y * size - 90, x * size - 180
+    max_lat, max_lng = min(min_lat + size, 90), min(min_lng + size, 180)
+
+    # Points on the north and east edges of the world belong to the last cell
+    max_row, max_column = math.ceil(180 / cell) - 1, math.ceil(360 / cell) - 1
+
+    # Points on a shared tile edge are picked up by both tiles, but each keeps only its own cells
+    cells = (
+        queryset.filter(geo.bbox_filter(min_lat, max_lat, min_lng, max_lng, prefix=prefix))
+        .annotate(
+            cell_row=Least(Floor((F(lat_field) + 90) / cell), Value(max_row), output_field=IntegerField()),
+            cell_column=Least(Floor((F(lng_field) + 180) / cell), Value(max_column), output_field=IntegerField()),
+        )
+        .values("cell_row", "cell_column")
+        .annotate(
+            count=Count("pk"),
+            latitude=Avg(lat_field),
+            longitude=Avg(lng_field),
+            min_lat=Min(lat_field),
+            max_lat=Max(lat_field),
+            min_lng=Min(lng_field),
+            max_lng=Max(lng_field),
+        )
+        .order_by()
+    )
+
+    return [{
+        "count": cluster["count"],
+        "latitude": cluster["latitude"],
+        "longitude": cluster["longitude"],
+        "min_lat": cluster["min_lat"],
+        "max_lat": cluster["max_lat"],
+        "min_lng": cluster["min_lng"],
+        "max_lng": cluster["max_lng"],
+    } for cluster in cells if (cluster["cell_row"] // CLUSTERS_PER_TILE, cluster["cell_column"] // CLUSTERS_PER_TILE) == (y, x)]
+
+
+def clusters(layer, queryset, zoom, viewport, prefix="", key_parts=()):
+    """
+    Clusters of every tile covering the viewport, served from the cache when possible.
+
+    Tiles are cached under the "map" version, which api.signals bumps whenever a
+    location, event or home changes. `key_parts` adds anything else the queryset depends
+    on, such as a time window. Returns None when the viewport needs too many tiles.
+    """
+    tiles = covering_tiles(zoom, *viewport)
+    if tiles is None:
+        return None
+
+    key_prefix = versioned_key("map", "clusters", layer, *key_parts, zoom)
+    keys = {f"{key_prefix}:{x}:{y}": (x, y) for x, y in tiles}
+    cached = cache.get_many(keys)
+
+    missing = {}
+    for key, (x, y) in keys.items():
+        if key not in cached:
+            missing[key] = tile_clusters(queryset, zoom, x, y, prefix=prefix)
+    if missing:
+        cache.set_many(missing, timeout=TILE_TIMEOUT)
+
+    result = []
+    for key in keys:
+        result.extend(cached.get(key, missing.get(key)))
+    return result
@@ -0,0 +1,86 @@
+import hashlib
+
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def make_etag(*parts):
+    return '"{}"'.format(hashlib.md5(":".join(map(str, parts)).encode()).hexdigest())
+
+
+def query_fingerprint(request):
+    # request.GET works for both DRF and plain Django requests
+    return make_etag(sorted((name, value) for name, values in request.GET.lists() for value in values))
+
+
+def resource_etag(request, version):
+    # Plain Django requests come from the async views, which only render JSON
+    media_type = getattr(request, "accepted_media_type", "application/json")
+    return make_etag(request.path, query_fingerprint(request), media_type, *version)
+
+
+def etag_matches(request, etag):
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as recommended for If-None-Match
+    candidates = {candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")}
+    return etag in candidates
+
+
+def unmodified_since(request, last_modified):
+    # If-None-Match takes precedence when both are sent (RFC 9110 13.2.2)
+    if last_modified is None or "If-None-Match" in request.headers:
+        return False
+    if_modified_since = parse_http_date_safe(request.headers.get("If-Modified-Since", ""))
+    # HTTP dates only have second precision, a change within the header's second may have
+    # been written after the response it validates, so only strictly older changes count
+    return if_modified_since is not None and int(last_modified.timestamp()) < if_modified_since
+
+
+def set_validators(response, etag, last_modified=None):
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+    patch_vary_headers(response, ["Accept"])
+    return response
+
+
+def not_modified(etag, last_modified=None):
+    return set_validators(Response(status=status.HTTP_304_NOT_MODIFIED), etag, last_modified)
+
+
+def conditional_response(request, version, build, last_modified=None):
+    """
+    Answer a conditional GET from a cheap version fingerprint of the resource.
+
+    `version` is anything that changes whenever the body would (typically a few indexed
+    aggregates such as max id and row count). Unchanged polls get a 304 before build()
+    runs, otherwise build()'s response is returned with ETag and Last-Modified set.
+    Resources that can change several times a second should only rely on the ETag.
+    """
+    etag = resource_etag(request, version)
+    if etag_matches(request, etag) or unmodified_since(request, last_modified):
+        return not_modified(etag, last_modified)
+
+    response = build()
+    if response.status_code == status.HTTP_200_OK:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+async def aconditional_response(request, version, build):
+    """conditional_response() for the async views, `build` is a coroutine function returning a JsonResponse."""
+    etag = resource_etag(request, version)
+    if etag_matches(request, etag):
+        return set_validators(HttpResponseNotModified(), etag)
+
+    response = await build()
+    if response.status_code == status.HTTP_200_OK:
+        set_validators(response, etag)
+    return response
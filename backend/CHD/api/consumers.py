@@ -0,0 +1,50 @@
+import asyncio
+import json
+import re
+
+from .broker import get_broker, conversation_channel
+from .models import Conversation
+
+
+CONVERSATION_PATH = re.compile(r"^/ws/conversations/(?P<id>\d+)/$")
+
+
+async def conversation_socket(scope, receive, send):
+    """
+    ASGI websocket app that streams new messages of a single conversation.
+
+    Clients connect to /ws/conversations/<id>/ and receive every message created
+    after the connection opened as a JSON text frame.
+    """
+    match = CONVERSATION_PATH.match(scope["path"])
+
+    event = await receive()
+    if event["type"] != "websocket.connect":
+        return
+
+    if match is None or not await Conversation.objects.filter(id=match["id"]).aexists():
+        await send({"type": "websocket.close", "code": 4404})
+        return
+
+    subscription = get_broker().subscribe(conversation_channel(match["id"]))
+    await send({"type": "websocket.accept"})
+
+    receive_task = asyncio.ensure_future(receive())
+    message_task = asyncio.ensure_future(subscription.get())
+    try:
+        while True:
+            done, _ = await asyncio.wait({receive_task, message_task}, return_when=asyncio.FIRST_COMPLETED)
+
+            if message_task in done:
+                await send({"type": "websocket.send", "text": json.dumps(message_task.result())})
+                message_task = asyncio.ensure_future(subscription.get())
+
+            if receive_task in done:
+                # The socket is push-only, anything other than a disconnect is ignored
+                if receive_task.result()["type"] == "websocket.disconnect":
+                    break
+                receive_task = asyncio.ensure_future(receive())
+    finally:
+        receive_task.cancel()
+        message_task.cancel()
+        subscription.close()
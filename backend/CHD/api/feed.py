@@ -0,0 +1,64 @@
+from django.utils import timezone
+
+from . import geo
+from .models import Event, EventFeedEntry, UserRefs
+
+
+# Events this close to a user's home show up in their available events feed
+RADIUS_KM = 100
+
+
+def _within_radius(rows, latitude, longitude):
+    # rows are (id, latitude, longitude, ...) tuples from a bounding box query
+    return [row for row in rows if geo.haversine_km(latitude, longitude, row[1], row[2]) <= RADIUS_KM]
+
+
+def add_event(event, user_ids=None):
+    """
+    Add an upcoming event to the feed of every user living near it who hasn't joined it.
+
+    Called when the event is created, and with `user_ids` when some users leave it.
+    """
+    if event.date < timezone.now():
+        return
+
+    # Coordinates straight from a request may still be strings
+    latitude, longitude = float(event.location_id.latitude), float(event.location_id.longitude)
+    homes = UserRefs.objects.current().exclude(user_id__event=event).filter(
+        geo.bbox_filter(*geo.bbox_around(latitude, longitude, RADIUS_KM), prefix="location_id__")
+    )
+    if user_ids is not None:
+        homes = homes.filter(user_id__in=user_ids)
+
+    rows = homes.values_list("user_id", "location_id__latitude", "location_id__longitude")
+    EventFeedEntry.objects.bulk_create(
+        [EventFeedEntry(user_id_id=row[0], event_id=event, date=event.date)
+         for row in _within_radius(rows, latitude, longitude)],
+        ignore_conflicts=True,
+    )
+
+
+def remove_event(event, user_ids):
+    # Joined events leave the feed
+    EventFeedEntry.objects.filter(event_id=event, user_id__in=user_ids).delete()
+
+
+def rebuild_user(user_id, home):
+    """Recompute the feed of a user from scratch, e.g. after they moved to `home`."""
+    latitude, longitude = float(home.latitude), float(home.longitude)
+    events = Event.objects.filter(date__gte=timezone.now()).exclude(users__id=user_id).filter(
+        geo.bbox_filter(*geo.bbox_around(latitude, longitude, RADIUS_KM), prefix="location_id__")
+    )
+    rows = events.values_list("id", "location_id__latitude", "location_id__longitude", "date")
+
+    EventFeedEntry.objects.filter(user_id=user_id).delete()
+    EventFeedEntry.objects.bulk_create(
+        EventFeedEntry(user_id_id=user_id, event_id_id=row[0], date=row[3])
+        for row in _within_radius(rows, latitude, longitude)
+    )
+
+
+def expire():
+    """Delete the entries of events that already happened. Returns how many were deleted."""
+    deleted, _ = EventFeedEntry.objects.filter(date__lt=timezone.now()).delete()
+    return deleted
@@ -0,0 +1,156 @@
+import math
+
+from django.db.models import Q
+
+
+# Locations are bucketed into a fixed grid of CELL_SIZE degree cells, numbered row by row
+# from the south-west corner, so one row of a bounding box is one contiguous range of cells.
+CELL_SIZE = 0.05
+ROWS = round(180 / CELL_SIZE)
+COLUMNS = round(360 / CELL_SIZE)
+
+# Viewports spanning more rows than this are filtered by plain coordinate ranges instead
+MAX_CELL_ROWS = 64
+
+
+def cell_row(latitude):
+    return min(max(math.floor((latitude + 90) / CELL_SIZE), 0), ROWS - 1)
+
+
+def cell_column(longitude):
+    return min(max(math.floor((longitude + 180) / CELL_SIZE), 0), COLUMNS - 1)
+
+
+def geocell(latitude, longitude):
+    return cell_row(latitude) * COLUMNS + cell_column(longitude)
+
+
+def bbox_filter(min_lat, max_lat, min_lng, max_lng, prefix=""):
+    """
+    Build a Q matching locations inside the bounding box.
+
+    min_lng > max_lng describes a box crossing the antimeridian. `prefix` lets the
+    filter be applied through a relation, e.g. "location_id__" on Event.
+    """
+    if min_lng <= max_lng:
+        column_ranges = [(cell_column(min_lng), cell_column(max_lng))]
+        longitude = Q(**{f"{prefix}longitude__range": (min_lng, max_lng)})
+    else:
+        column_ranges = [(cell_column(min_lng), COLUMNS - 1), (0, cell_column(max_lng))]
+        longitude = Q(**{f"{prefix}longitude__gte": min_lng}) | Q(**{f"{prefix}longitude__lte": max_lng})
+
+    coordinates = Q(**{f"{prefix}latitude__range": (min_lat, max_lat)}) & longitude
+
+    first_row, last_row = cell_row(min_lat), cell_row(max_lat)
+    if last_row - first_row + 1 > MAX_CELL_ROWS:
+        return coordinates
+
+    cells = Q()
+    for row in range(first_row, last_row + 1):
+        for first_column, last_column in column_ranges:
+            cells |= Q(**{f"{prefix}geocell__range": (row * COLUMNS + first_column, row * COLUMNS + last_column)})
+
+    # The cell ranges drive the index lookup, the coordinates trim the partially covered edge cells.
+    # Rows written by QuerySet.update() may not have a cell yet, they are matched on coordinates
+    return (cells | Q(**{f"{prefix}geocell__isnull": True})) & coordinates
+
+
+def viewport_from_params(params):
+    """
+    Read a viewport from query params, either as min_lat/max_lat/min_lng/max_lng or as a
+    latitude/longitude center with latitude_delta/longitude_delta spans.
+
+    Returns (min_lat, max_lat, min_lng, max_lng), or None when no viewport was given.
+    Raises ValueError for incomplete, non-numeric or out of range viewports.
+    """
+    bounds = ("min_lat", "max_lat", "min_lng", "max_lng")
+    region = ("latitude", "longitude", "latitude_delta", "longitude_delta")
+
+    if any(name in params for name in bounds):
+        min_lat, max_lat, min_lng, max_lng = _floats(params, bounds)
+        _check_longitudes(min_lng, max_lng)
+    elif any(name in params for name in region):
+        latitude, longitude, latitude_delta, longitude_delta = _floats(params, region)
+        _check_longitudes(longitude)
+        if latitude_delta < 0 or longitude_delta < 0:
+            raise ValueError("Invalid viewport")
+        min_lat, max_lat = latitude - latitude_delta / 2, latitude + latitude_delta / 2
+        min_lng, max_lng = longitude - longitude_delta / 2, longitude + longitude_delta / 2
+        if longitude_delta >= 360:
+            min_lng, max_lng = -180, 180
+        else:
+            # Wrap centers near the antimeridian back into [-180, 180]
+            min_lng = (min_lng + 180) % 360 - 180
+            max_lng = (max_lng + 180) % 360 - 180
+    else:
+        return None
+
+    if min_lat > max_lat:
+        raise ValueError("Invalid viewport")
+
+    return max(min_lat, -90), min(max_lat, 90), min_lng, max_lng
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1, math.sqrt(a)))
+
+
+def bbox_around(latitude, longitude, radius_km):
+    """Smallest (min_lat, max_lat, min_lng, max_lng) box containing the circle of radius_km."""
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = latitude - lat_delta, latitude + lat_delta
+    if min_lat <= -90 or max_lat >= 90:
+        # The circle covers a pole, so every longitude is in range
+        return max(min_lat, -90), min(max_lat, 90), -180, 180
+
+    lng_delta = math.degrees(math.asin(min(1, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(latitude)))))
+    if lng_delta >= 180:
+        return min_lat, max_lat, -180, 180
+    min_lng = (longitude - lng_delta + 180) % 360 - 180
+    max_lng = (longitude + lng_delta + 180) % 360 - 180
+    return min_lat, max_lat, min_lng, max_lng
+
+
+def nearest(queryset, latitude, longitude, radius_km, limit, prefix="", fields=()):
+    """
+    The `limit` rows of `queryset` closest to (latitude, longitude) and within radius_km.
+
+    Candidates come from the grid index with a search box that starts small and doubles
+    until it holds enough rows, then exact haversine distances filter and sort them.
+    Returns (distance_km, row) pairs, rows being values() dicts of `fields`.
+    """
+    lat_field, lng_field = f"{prefix}latitude", f"{prefix}longitude"
+    search_km = min(radius_km, 2.0)
+    while True:
+        candidates = queryset.filter(bbox_filter(*bbox_around(latitude, longitude, search_km), prefix=prefix))
+        matches = []
+        for row in candidates.values(*fields, lat_field, lng_field):
+            distance = haversine_km(latitude, longitude, row[lat_field], row[lng_field])
+            if distance <= search_km:
+                matches.append((distance, row))
+
+        if len(matches) >= limit or search_km >= radius_km:
+            matches.sort(key=lambda match: match[0])
+            return matches[:limit]
+        search_km = min(search_km * 2, radius_km)
+
+
+def _floats(params, names):
+    missing = [name for name in names if name not in params]
+    if missing:
+        raise ValueError(f"Missing viewport parameters: {', '.join(missing)}")
+    values = [float(params[name]) for name in names]
+    # float() accepts "nan" and "inf", which no grid cell or coordinate range can hold
+    if not all(math.isfinite(value) for value in values):
+        raise ValueError("Viewport parameters must be finite numbers")
+    return values
+
+
+def _check_longitudes(*longitudes):
+    if not all(-180 <= longitude <= 180 for longitude in longitudes):
+        raise ValueError("Longitudes must be between -180 and 180")
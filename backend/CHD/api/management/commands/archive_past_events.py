@@ -0,0 +1,71 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from api.models import ArchivedEvent, Event, Location, UserRefs
+
+
+class Command(BaseCommand):
+    help = (
+        "Move events that ended more than --days days ago, with their attendees, into the archive tables "
+        "and delete their Locations, keeping the live event tables small."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=1, help="Only archive events older than this many days.")
+        parser.add_argument("--batch-size", type=int, default=500, help="Events moved per transaction.")
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be archived without moving it.")
+
+    def handle(self, *args, **options):
+        past = Event.objects.filter(date__lt=timezone.now() - timedelta(days=options["days"]))
+
+        if options["dry_run"]:
+            self.stdout.write(self.style.SUCCESS(f"Would archive {past.count()} events."))
+            return
+
+        archived = attendees = 0
+        while True:
+            # Short transactions so writers aren't locked out for the whole run
+            with transaction.atomic():
+                events = list(past.select_related("location_id").order_by("date", "id")[:options["batch_size"]])
+                if not events:
+                    break
+                attendees += self.archive(events)
+                archived += len(events)
+
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} events with {attendees} attendees."))
+
+    def archive(self, events):
+        ArchivedEvent.objects.bulk_create(ArchivedEvent(
+            id=event.id,
+            owner_id=event.owner_id,
+            name=event.name,
+            description=event.description,
+            date=event.date,
+            city=event.location_id.city,
+            country=event.location_id.country,
+            region=event.location_id.region,
+            latitude=event.location_id.latitude,
+            longitude=event.location_id.longitude,
+        ) for event in events)
+
+        event_ids = [event.id for event in events]
+        rows = Event.users.through.objects.filter(event_id__in=event_ids).values_list("event_id", "user_id")
+        Attendee = ArchivedEvent.users.through
+        archived_attendees = Attendee.objects.bulk_create(
+            Attendee(archivedevent_id=event_id, user_id=user_id) for event_id, user_id in rows
+        )
+
+        # Attendee and feed rows go with the events, locations are only kept while still used
+        Event.objects.filter(id__in=event_ids).delete()
+        Location.objects.filter(
+            id__in=[event.location_id_id for event in events],
+        ).filter(
+            ~Exists(UserRefs.objects.filter(location_id=OuterRef("pk"))),
+            ~Exists(Event.objects.filter(location_id=OuterRef("pk"))),
+        ).delete()
+
+        return len(archived_attendees)
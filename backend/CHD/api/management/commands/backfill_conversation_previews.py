@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from api.models import Conversation, Message
+
+
+class Command(BaseCommand):
+    help = "Populate Conversation.last_message/last_message_at from existing messages."
+
+    def handle(self, *args, **options):
+        latest = Message.objects.filter(to_conversation_id=OuterRef("pk")).order_by("-timestamp", "-id")
+
+        with transaction.atomic():
+            updated = Conversation.objects.update(
+                last_message=Subquery(latest.values("id")[:1]),
+                last_message_at=Subquery(latest.values("timestamp")[:1]),
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {updated} conversations."))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef
+
+from api.models import Location, UserRefs, Event
+
+
+class Command(BaseCommand):
+    help = "Collapse each user's UserRefs history into their current home and delete orphaned Locations."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be deleted without deleting it.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # Users whose history has no current row keep their latest home
+            current = UserRefs.objects.current().filter(user_id=OuterRef("user_id"))
+            latest = (UserRefs.objects.filter(~Exists(current)).values("user_id")
+                      .annotate(latest_id=Max("id")).values("latest_id"))
+            promoted = UserRefs.objects.filter(id__in=latest).update(is_current=True)
+
+            stale_refs, _ = UserRefs.objects.filter(is_current=False).delete()
+
+            orphans, _ = Location.objects.filter(
+                ~Exists(UserRefs.objects.filter(location_id=OuterRef("pk"))),
+                ~Exists(Event.objects.filter(location_id=OuterRef("pk"))),
+            ).delete()
+
+            if options["dry_run"]:
+                transaction.set_rollback(True)
+
+        prefix = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} {stale_refs} stale UserRefs and {orphans} orphaned Locations "
+            f"({promoted} users had their latest home marked current)."
+        ))
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, OperationalError
+
+from api.messaging import post_message
+from api.models import User, Conversation
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure concurrent-writer throughput by sending messages from several threads at once. "
+        "Writes to the configured database, so point CHD_DB_NAME at a scratch copy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--messages", type=int, default=200, help="Messages sent by each thread.")
+        parser.add_argument("--keep", action="store_true", help="Keep the generated users and messages.")
+
+    def handle(self, *args, **options):
+        threads, per_thread = options["threads"], options["messages"]
+
+        conversation = Conversation.objects.create(name="Load test")
+        users = [User.objects.create_user(username=f"loadtest-{time.time_ns()}-{i}", first_name=f"Writer {i}")
+                 for i in range(threads)]
+        conversation.users.add(*users)
+
+        failures = []
+        start = threading.Barrier(threads + 1)
+
+        def writer(user):
+            start.wait()
+            try:
+                for i in range(per_thread):
+                    try:
+                        post_message(f"message {i}", user, conversation)
+                    except OperationalError as error:
+                        failures.append(error)
+            finally:
+                # Every thread has its own connection, close it before the thread goes away
+                connections.close_all()
+
+        workers = [threading.Thread(target=writer, args=(user,)) for user in users]
+        for worker in workers:
+            worker.start()
+        start.wait()
+        began = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - began
+
+        written = threads * per_thread - len(failures)
+        with connection.cursor() as cursor:
+            journal_mode = cursor.execute("PRAGMA journal_mode").fetchone()[0] if connection.vendor == "sqlite" else "-"
+
+        if not options["keep"]:
+            conversation.delete()
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+
+        self.stdout.write(
+            f"{connection.vendor} (journal_mode={journal_mode}): {threads} writers, {written} messages in "
+            f"{elapsed:.2f}s = {written / elapsed:.0f} messages/s, {len(failures)} failed writes"
+        )
+        if failures:
+            self.stdout.write(self.style.WARNING(f"First failure: {failures[0]}"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api import feed
+from api.cache import bump_version
+from api.models import UserRefs
+
+
+class Command(BaseCommand):
+    help = (
+        "Drop past events from the available events feeds. Run it periodically, e.g. hourly from cron. "
+        "With --rebuild every feed is recomputed, which also backfills feeds after the first deploy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rebuild", action="store_true", help="Recompute the feed of every user with a home.")
+
+    def handle(self, *args, **options):
+        expired = feed.expire()
+
+        rebuilt = 0
+        if options["rebuild"]:
+            for home in UserRefs.objects.current().select_related("location_id").iterator():
+                with transaction.atomic():
+                    feed.rebuild_user(home.user_id_id, home.location_id)
+                rebuilt += 1
+
+        bump_version("events")
+        self.stdout.write(self.style.SUCCESS(f"Expired {expired} feed entries, rebuilt {rebuilt} feeds."))
@@ -0,0 +1,129 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, DateTimeField, F, IntegerField, Q, Value, When
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from .broker import get_broker, conversation_channel
+from .models import Message, Conversation, ReadCursor
+
+
+def message_payload(message, sender_first_name):
+    # Same shape as the items returned by GetConversationMessagesView
+    return {
+        "id": message.id,
+        "content": message.content,
+        "from_user_id": message.from_user_id_id,
+        "to_conversation_id": message.to_conversation_id_id,
+        # Formatted like DRF renders it ("Z" for UTC), payloads are sent as plain JSON
+        "timestamp": JSONEncoder().default(message.timestamp),
+        "sender_first_name": sender_first_name,
+    }
+
+
+def publish_message(message, sender_first_name):
+    payload = message_payload(message, sender_first_name)
+    get_broker().publish(conversation_channel(message.to_conversation_id_id), payload)
+
+
+def newest_messages(messages):
+    """The newest of `messages` in each conversation, keyed by conversation id."""
+    newest = {}
+    for message in messages:
+        conversation_id = message.to_conversation_id_id
+        if conversation_id not in newest or newest[conversation_id].id < message.id:
+            newest[conversation_id] = message
+    return newest
+
+
+def record_last_messages(messages):
+    """Point each conversation at its newest message among `messages`, in a single UPDATE."""
+    newest = newest_messages(messages)
+
+    # Only move the pointer forward, a slower concurrent writer must not overwrite a newer message
+    def forward(message, value):
+        return When(Q(id=message.to_conversation_id_id) & (Q(last_message__isnull=True) | Q(last_message_id__lt=message.id)),
+                    then=Value(value))
+
+    Conversation.objects.filter(id__in=newest).update(
+        last_message=Case(*(forward(message, message.id) for message in newest.values()),
+                          default=F("last_message"), output_field=BigIntegerField()),
+        last_message_at=Case(*(forward(message, message.timestamp) for message in newest.values()),
+                             default=F("last_message_at"), output_field=DateTimeField()),
+    )
+
+
+def record_unread(from_user, messages):
+    """
+    Count `messages` as unread for every other member, in two UPDATEs however many members.
+
+    The sender has read their own conversation up to the message they just sent.
+    """
+    sent = Counter(message.to_conversation_id_id for message in messages)
+    ReadCursor.objects.filter(conversation_id__in=sent).exclude(user_id=from_user).update(
+        unread_count=F("unread_count") + Case(
+            *(When(conversation_id=conversation_id, then=Value(count)) for conversation_id, count in sent.items()),
+            default=Value(0), output_field=IntegerField(),
+        ),
+    )
+
+    newest = newest_messages(messages)
+    ReadCursor.objects.filter(conversation_id__in=newest, user_id=from_user).update(
+        unread_count=0,
+        last_read_message=Case(
+            *(When(conversation_id=conversation_id, then=Value(message.id)) for conversation_id, message in newest.items()),
+            output_field=BigIntegerField(),
+        ),
+        updated_at=timezone.now(),
+    )
+
+
+def mark_read(cursor, message_id=None):
+    """
+    Move `cursor` forward to message_id, by default the newest message of its conversation.
+
+    Only the messages left after it are counted, through the (conversation, id) index.
+    The caller locks `cursor` so concurrent sends add to the recount rather than being lost.
+    """
+    conversation = cursor.conversation_id
+    if message_id is None:
+        message_id = conversation.last_message_id
+    if message_id is None or (cursor.last_read_message_id or 0) >= message_id:
+        return cursor
+
+    cursor.unread_count = (
+        Message.objects.filter(to_conversation_id=conversation, id__gt=message_id)
+        .exclude(from_user_id=cursor.user_id_id).count()
+    )
+    cursor.last_read_message_id = message_id
+    cursor.save(update_fields=["unread_count", "last_read_message", "updated_at"])
+    return cursor
+
+
+def post_message(content, from_user, conversation):
+    """Create a message and push it to live subscribers once the write is committed."""
+    return post_messages(from_user, [(conversation.id, content)])[0]
+
+
+def post_messages(from_user, items):
+    """
+    Create one message per (conversation_id, content) pair with a single INSERT.
+
+    Conversation pointers and unread counters are moved in a few UPDATEs, and every
+    message is pushed to live subscribers once the write is committed.
+    """
+    with transaction.atomic():
+        messages = Message.objects.bulk_create(
+            Message(content=content, from_user_id=from_user, to_conversation_id_id=conversation_id)
+            for conversation_id, content in items
+        )
+        record_last_messages(messages)
+        record_unread(from_user, messages)
+
+    def publish():
+        for message in messages:
+            publish_message(message, from_user.first_name)
+
+    transaction.on_commit(publish)
+    return messages
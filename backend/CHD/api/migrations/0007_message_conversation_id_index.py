@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_remove_userrefs_address_id_location_city_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['to_conversation_id', 'id'], name='api_message_convo_id_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:56
+
+import math
+
+from django.db import migrations, models
+
+
+# The grid of api.geo as of this migration, frozen so later changes there don't rewrite history
+CELL_SIZE = 0.05
+ROWS = round(180 / CELL_SIZE)
+COLUMNS = round(360 / CELL_SIZE)
+
+
+def geocell(latitude, longitude):
+    row = min(max(math.floor((latitude + 90) / CELL_SIZE), 0), ROWS - 1)
+    column = min(max(math.floor((longitude + 180) / CELL_SIZE), 0), COLUMNS - 1)
+    return row * COLUMNS + column
+
+
+def backfill_geocells(apps, schema_editor):
+    Location = apps.get_model("api", "Location")
+    locations = list(Location.objects.only("latitude", "longitude"))
+    for location in locations:
+        location.geocell = geocell(location.latitude, location.longitude)
+    Location.objects.bulk_update(locations, ["geocell"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_conversation_last_message'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='geocell',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(fields=['latitude', 'longitude'], name='api_location_lat_lng_idx'),
+        ),
+        migrations.RunPython(backfill_geocells, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:04
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def mark_latest_homes_current(apps, schema_editor):
+    UserRefs = apps.get_model("api", "UserRefs")
+    latest = UserRefs.objects.values("user_id").annotate(latest_id=Max("id")).values("latest_id")
+    UserRefs.objects.filter(id__in=latest).update(is_current=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_location_geocell'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userrefs',
+            name='is_current',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_latest_homes_current, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='userrefs',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_current', True)), fields=('user_id',), name='api_userrefs_one_current_home'),
+        ),
+    ]
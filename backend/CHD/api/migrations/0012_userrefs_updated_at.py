@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_userrefs_current_home'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userrefs',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:21
+
+import math
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+# api.feed.RADIUS_KM and api.geo's haversine as of this migration, frozen so later changes
+# there don't rewrite history
+RADIUS_KM = 100
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1, math.sqrt(a)))
+
+
+def backfill_feeds(apps, schema_editor):
+    # Same entries as api.feed.rebuild_user for every current home
+    UserRefs = apps.get_model("api", "UserRefs")
+    Event = apps.get_model("api", "Event")
+    EventFeedEntry = apps.get_model("api", "EventFeedEntry")
+    upcoming = Event.objects.filter(date__gte=timezone.now())
+    latitude_delta = math.degrees(RADIUS_KM / EARTH_RADIUS_KM)
+
+    for user_id, latitude, longitude in UserRefs.objects.filter(is_current=True).values_list(
+        "user_id", "location_id__latitude", "location_id__longitude"
+    ).iterator():
+        # The latitude band narrows the candidates down, the exact distance decides
+        events = upcoming.exclude(users__id=user_id).filter(
+            location_id__latitude__range=(latitude - latitude_delta, latitude + latitude_delta)
+        )
+        EventFeedEntry.objects.bulk_create(
+            (EventFeedEntry(user_id_id=user_id, event_id_id=event_id, date=date)
+             for event_id, event_latitude, event_longitude, date in events.values_list(
+                 "id", "location_id__latitude", "location_id__longitude", "date")
+             if haversine_km(latitude, longitude, event_latitude, event_longitude) <= RADIUS_KM),
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_event_date_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventFeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateTimeField()),
+                ('event_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='api.event')),
+                ('user_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='event_feed', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_id', 'date', 'event_id'], name='api_feed_user_date_idx'), models.Index(fields=['date'], name='api_feed_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user_id', 'event_id'), name='api_eventfeedentry_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_feeds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_event_feed'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('description', models.TextField()),
+                ('date', models.DateTimeField(db_index=True)),
+                ('city', models.CharField(default='', max_length=200)),
+                ('country', models.CharField(default='', max_length=200)),
+                ('region', models.CharField(default='', max_length=200)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('owner_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_owned_events', to=settings.AUTH_USER_MODEL)),
+                ('users', models.ManyToManyField(related_name='archived_event', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,59 @@
+from django.db import migrations
+
+
+# External content FTS5 indexes, kept in sync by triggers so that bulk_create and raw
+# writes are covered too. Only SQLite has FTS5, other databases fall back to api.search's
+# LIKE queries. SQLite drops the triggers when a later migration rebuilds one of these
+# tables, api.search.ensure_indexes() restores them after every migrate. The DDL is
+# frozen here so this migration doesn't change with api.search.
+INDEXES = {
+    "api_message_fts": ("api_message", ["content"]),
+    "api_event_fts": ("api_event", ["name", "description"]),
+    "api_user_fts": ("auth_user", ["first_name", "last_name"]),
+}
+
+
+def index_sql(index, table, columns):
+    names = ", ".join(columns)
+    new = ", ".join(f"new.{column}" for column in columns)
+    old = ", ".join(f"old.{column}" for column in columns)
+    delete = f"INSERT INTO {index}({index}, rowid, {names}) VALUES ('delete', old.id, {old});"
+    insert = f"INSERT INTO {index}(rowid, {names}) VALUES (new.id, {new});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5({names}, content='{table}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS {index}_update AFTER UPDATE OF {names} ON {table} BEGIN {delete} {insert} END",
+        f"INSERT INTO {index}({index}) VALUES ('rebuild')",
+    ]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for index, (table, columns) in INDEXES.items():
+        for statement in index_sql(index, table, columns):
+            schema_editor.execute(statement)
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for index in INDEXES:
+        for trigger in ("insert", "delete", "update"):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {index}_{trigger}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {index}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_archived_event'),
+        # After the last migration rebuilding auth_user, which would drop its triggers
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:31
+
+import django.db.models.deletion
+from django.conf import settings
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+
+# api.typeahead's tokenizer as of this migration, frozen so later changes there don't rewrite history
+def name_tokens(first_name, last_name):
+    decomposed = unicodedata.normalize("NFKD", f"{first_name} {last_name}".casefold())
+    return set(re.findall(r"\w+", "".join(char for char in decomposed if not unicodedata.combining(char))))
+
+
+def backfill_tokens(apps, schema_editor):
+    User = apps.get_model("auth", "User")
+    UserNameToken = apps.get_model("api", "UserNameToken")
+    UserNameToken.objects.bulk_create(
+        (UserNameToken(user_id_id=user_id, token=token)
+         for user_id, first_name, last_name in User.objects.values_list("id", "first_name", "last_name")
+         for token in name_tokens(first_name, last_name)),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserNameToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=150)),
+                ('user_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='name_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'user_id'], name='api_usernametoken_token_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user_id', 'token'), name='api_usernametoken_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_tokens, migrations.RunPython.noop),
+    ]
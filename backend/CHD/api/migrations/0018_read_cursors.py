@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_cursors(apps, schema_editor):
+    # Existing members start with everything read
+    Conversation = apps.get_model("api", "Conversation")
+    ReadCursor = apps.get_model("api", "ReadCursor")
+    memberships = Conversation.users.through.objects.values_list("user_id", "conversation_id", "conversation__last_message_id")
+    ReadCursor.objects.bulk_create(
+        (ReadCursor(user_id_id=user_id, conversation_id_id=conversation_id, last_read_message_id=last_message_id)
+         for user_id, conversation_id, last_message_id in memberships.iterator()),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_user_name_tokens'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReadCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('conversation_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_cursors', to='api.conversation')),
+                ('last_read_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.message')),
+                ('user_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_cursors', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['conversation_id', 'user_id'], name='api_readcursor_convo_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user_id', 'conversation_id'), name='api_readcursor_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_cursors, migrations.RunPython.noop),
+    ]
@@ -2,11 +2,16 @@ from django.utils import timezone
 from django.db import models
 from django.contrib.auth.models import User
 
+from . import geo
+
 # Create your models here.
 
 class Conversation(models.Model):
     name = models.CharField(max_length=200)
     users = models.ManyToManyField(User, related_name="conversation")
+    # Denormalized pointer to the newest message so the inbox needs no per-conversation lookups
+    last_message = models.ForeignKey("Message", null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    last_message_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     def __str__(self):
         return f"Conversation: {self.name}"
@@ -18,10 +23,55 @@ class Message(models.Model):
     to_conversation_id = models.ForeignKey(Conversation, on_delete=models.CASCADE)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Covers the incremental "after_id" sync used by chat polling
+            models.Index(fields=["to_conversation_id", "id"], name="api_message_convo_id_idx"),
+            # Keyset pagination over (timestamp, id) within a conversation
+            models.Index(fields=["to_conversation_id", "timestamp", "id"], name="api_message_convo_ts_idx"),
+        ]
+
     def __str__(self):
         return f"Message content: {self.content}"
     
 
+class LocationQuerySet(models.QuerySet):
+    """
+    Keeps Location.geocell in step with bulk writes, which skip Location.save().
+
+    bulk_create() and bulk_update() compute the cells. update() can't compute one per row, so changing
+    coordinates clears the cell (api.geo.bbox_filter falls back to the coordinates for
+    such rows) and the caller should follow up with fill_geocells().
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for location in objs:
+            location.geocell = geo.geocell(float(location.latitude), float(location.longitude))
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if {"latitude", "longitude"} & set(fields):
+            objs = list(objs)
+            for location in objs:
+                location.geocell = geo.geocell(float(location.latitude), float(location.longitude))
+            fields = {*fields, "geocell"}
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+    def update(self, **kwargs):
+        if {"latitude", "longitude"} & kwargs.keys() and "geocell" not in kwargs:
+            kwargs["geocell"] = None
+        return super().update(**kwargs)
+
+    def fill_geocells(self, batch_size=500):
+        """Compute the missing cells of the locations in this queryset. Returns how many were filled."""
+        locations = list(self.filter(geocell__isnull=True).only("latitude", "longitude"))
+        for location in locations:
+            location.geocell = geo.geocell(location.latitude, location.longitude)
+        self.model.objects.bulk_update(locations, ["geocell"], batch_size=batch_size)
+        return len(locations)
+
+
 class Location(models.Model):
     city = models.CharField(max_length=200, default="")
     country = models.CharField(max_length=200, default="")
@@ -30,14 +80,49 @@ class Location(models.Model):
     longitude = models.FloatField()
     latitude_delta = models.FloatField()
     longitude_delta = models.FloatField()
+    # Grid cell of (latitude, longitude), see api.geo. Kept in sync by save() and by the
+    # LocationQuerySet bulk writes. NULL means unknown, bbox_filter then uses the coordinates
+    geocell = models.IntegerField(null=True, blank=True, db_index=True)
+
+    objects = LocationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Fallback for viewports too large for the cell index
+            models.Index(fields=["latitude", "longitude"], name="api_location_lat_lng_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.geocell = geo.geocell(float(self.latitude), float(self.longitude))
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = {*kwargs["update_fields"], "geocell"}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Location: {self.latitude}, {self.longitude}"
 
 
+class UserRefsQuerySet(models.QuerySet):
+
+    def current(self):
+        # The home each user lives at now. SetUserLocationView updates it in place, rows left
+        # over from before that are collapsed by the compact_user_locations command
+        return self.filter(is_current=True)
+
+
 class UserRefs(models.Model):
     user_id = models.ForeignKey(User, on_delete=models.CASCADE)
     location_id = models.ForeignKey(Location, on_delete=models.CASCADE)
+    is_current = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = UserRefsQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # At most one current home per user, which also indexes the current home lookup
+            models.UniqueConstraint(fields=["user_id"], condition=models.Q(is_current=True), name="api_userrefs_one_current_home"),
+        ]
 
 
 class Event(models.Model):
@@ -47,3 +132,78 @@ class Event(models.Model):
     date = models.DateTimeField(default=timezone.now)
     users = models.ManyToManyField(User, related_name="event")
     location_id = models.ForeignKey(Location, on_delete=models.CASCADE)
+
+    class Meta:
+        indexes = [
+            # Event listings are filtered and ordered by date
+            models.Index(fields=["date", "id"], name="api_event_date_idx"),
+        ]
+
+
+class EventFeedEntry(models.Model):
+    # Materialized "available events" row: an upcoming event near the user's home they haven't joined.
+    # Maintained by api.feed, so reading a feed is one range scan instead of an anti-join over all events.
+    user_id = models.ForeignKey(User, on_delete=models.CASCADE, related_name="event_feed")
+    event_id = models.ForeignKey(Event, on_delete=models.CASCADE, related_name="feed_entries")
+    date = models.DateTimeField()  # Copy of event_id.date
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user_id", "event_id"], name="api_eventfeedentry_unique"),
+        ]
+        indexes = [
+            # A user's feed in date order
+            models.Index(fields=["user_id", "date", "event_id"], name="api_feed_user_date_idx"),
+            # Expiry of past events
+            models.Index(fields=["date"], name="api_feed_date_idx"),
+        ]
+
+
+class ArchivedEvent(models.Model):
+    # Past events moved out of the hot tables by the archive_past_events command. The id is the
+    # one the event had while live, and the location is copied since it's deleted with the event.
+    owner_id = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_owned_events")
+    name = models.CharField(max_length=200)
+    description = models.TextField()
+    date = models.DateTimeField(db_index=True)
+    users = models.ManyToManyField(User, related_name="archived_event")
+    city = models.CharField(max_length=200, default="")
+    country = models.CharField(max_length=200, default="")
+    region = models.CharField(max_length=200, default="")
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+
+class UserNameToken(models.Model):
+    # One row per normalized word of a user's first and last name, see api.typeahead
+    user_id = models.ForeignKey(User, on_delete=models.CASCADE, related_name="name_tokens")
+    token = models.CharField(max_length=150)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user_id", "token"], name="api_usernametoken_unique"),
+        ]
+        indexes = [
+            # Prefix lookups are range scans over the tokens
+            models.Index(fields=["token", "user_id"], name="api_usernametoken_token_idx"),
+        ]
+
+
+class ReadCursor(models.Model):
+    # How far a member has read a conversation. unread_count is maintained on every send
+    # (api.messaging) so the inbox never counts messages. Rows follow Conversation.users.
+    user_id = models.ForeignKey(User, on_delete=models.CASCADE, related_name="read_cursors")
+    conversation_id = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="read_cursors")
+    last_read_message = models.ForeignKey(Message, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    unread_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user_id", "conversation_id"], name="api_readcursor_unique"),
+        ]
+        indexes = [
+            # Send path: every cursor of a conversation
+            models.Index(fields=["conversation_id", "user_id"], name="api_readcursor_convo_idx"),
+        ]
@@ -0,0 +1,48 @@
+from rest_framework.renderers import JSONRenderer
+
+
+# Coordinates are sent as integers in units of 1e-5 degrees (about a metre)
+COORDINATE_SCALE = 10 ** 5
+COORDINATE_FIELDS = ("latitude", "longitude")
+
+
+def columnar(rows):
+    """
+    Turn a list of flat dicts into one array per key.
+
+    Keys holding the same value in every row are sent once under "constants", and
+    latitude/longitude columns are quantized and delta-encoded: the first value is
+    absolute and each following value is the difference to the previous one.
+    """
+    keys = list(rows[0]) if rows else []
+    columns, constants, encodings = {}, {}, {}
+
+    for key in keys:
+        values = [row.get(key) for row in rows]
+        if len(rows) > 1 and all(value == values[0] for value in values):
+            constants[key] = values[0]
+        elif key in COORDINATE_FIELDS and all(isinstance(value, (int, float)) for value in values):
+            quantized = [round(value * COORDINATE_SCALE) for value in values]
+            columns[key] = [quantized[0]] + [b - a for a, b in zip(quantized, quantized[1:])]
+            encodings[key] = f"delta/{COORDINATE_SCALE}"
+        else:
+            columns[key] = values
+
+    return {"count": len(rows), "columns": columns, "constants": constants, "encodings": encodings}
+
+
+class CompactJSONRenderer(JSONRenderer):
+    """
+    Columnar JSON for list endpoints returning many markers.
+
+    Selected with `Accept: application/vnd.chd.compact+json` or `?format=compact`.
+    Error bodies and non-list payloads are rendered as plain JSON.
+    """
+    media_type = "application/vnd.chd.compact+json"
+    format = "compact"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get("response")
+        if isinstance(data, list) and (response is None or not response.exception and response.status_code < 400):
+            data = columnar(data)
+        return super().render(data, accepted_media_type, renderer_context)
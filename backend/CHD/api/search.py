@@ -0,0 +1,157 @@
+import re
+
+from django.db import connection, connections
+from django.db.models import F, Q
+
+from .models import Conversation, Event, Message, User
+
+
+# Full-text search over the FTS5 indexes created by migration 0016. Every word of the query
+# matches as a prefix, hits are ranked by bm25 and paged with limit/offset. Databases without
+# FTS5 get an unranked LIKE search with the same results shape, newest first.
+
+# External content FTS5 indexes, kept in sync by triggers so that bulk_create and raw writes
+# are covered too. SQLite drops the triggers whenever a migration rebuilds one of these tables,
+# so api.signals calls ensure_indexes() after every migrate.
+INDEXES = {
+    "api_message_fts": ("api_message", ["content"]),
+    "api_event_fts": ("api_event", ["name", "description"]),
+    "api_user_fts": ("auth_user", ["first_name", "last_name"]),
+}
+TRIGGERS = ("insert", "delete", "update")
+
+
+def index_sql(index, table, columns):
+    """Statements creating `index` and its triggers, each a no-op when already there."""
+    names = ", ".join(columns)
+    new = ", ".join(f"new.{column}" for column in columns)
+    old = ", ".join(f"old.{column}" for column in columns)
+    delete = f"INSERT INTO {index}({index}, rowid, {names}) VALUES ('delete', old.id, {old});"
+    insert = f"INSERT INTO {index}(rowid, {names}) VALUES (new.id, {new});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5({names}, content='{table}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS {index}_update AFTER UPDATE OF {names} ON {table} BEGIN {delete} {insert} END",
+    ]
+
+
+def ensure_indexes(using="default"):
+    """
+    Create whatever is missing of the FTS5 indexes and their triggers on SQLite.
+
+    An index that lost a trigger has missed writes, so it is rebuilt from its table.
+    Returns the names of the repaired indexes.
+    """
+    db = connections[using]
+    if db.vendor != "sqlite":
+        return []
+
+    with db.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+        existing = {row[0] for row in cursor.fetchall()}
+
+        repaired = []
+        for index, (table, columns) in INDEXES.items():
+            expected = {index, *(f"{index}_{trigger}" for trigger in TRIGGERS)}
+            if table not in existing or expected <= existing:
+                continue
+            for statement in index_sql(index, table, columns):
+                cursor.execute(statement)
+            cursor.execute(f"INSERT INTO {index}({index}) VALUES ('rebuild')")
+            repaired.append(index)
+    return repaired
+
+MESSAGE_FIELDS = ("id", "content", "from_user_id", "to_conversation_id", "timestamp")
+EVENT_FIELDS = ("name", "description", "date")
+EVENT_ALIASES = {
+    "event_id": F("id"),
+    "city": F("location_id__city"), "region": F("location_id__region"), "country": F("location_id__country"),
+}
+USER_FIELDS = ("id", "first_name", "last_name")
+
+
+def query_words(query):
+    return re.findall(r"\w+", query or "")
+
+
+def match_expression(words):
+    # Quoted so FTS5 operators typed by users are searched for, not interpreted
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def _fts(sql, params):
+    """(id, snippet) pairs of an FTS5 query, best match first."""
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _like(words, fields):
+    condition = Q()
+    for word in words:
+        condition &= Q(*(Q(**{f"{field}__icontains": word}) for field in fields), _connector=Q.OR)
+    return condition
+
+
+def _in_rank_order(queryset, hits, key="id"):
+    rows = {row[key]: row for row in queryset.filter(id__in=[id for id, _ in hits])}
+    return [{**rows[id], "snippet": snippet} for id, snippet in hits if id in rows]
+
+
+def search_messages(user_id, words, limit, offset):
+    """Messages of the conversations `user_id` is a member of."""
+    messages = Message.objects.values(*MESSAGE_FIELDS, sender_first_name=F("from_user_id__first_name"))
+
+    if connection.vendor != "sqlite":
+        messages = messages.filter(_like(words, ["content"]), to_conversation_id__users__id=user_id)
+        return [{**message, "snippet": message["content"]} for message in messages.order_by("-id")[offset:offset + limit]]
+
+    # Membership is joined in before the LIMIT so pages aren't cut short by other people's messages
+    members = Conversation.users.through._meta.db_table
+    hits = _fts(f"""
+        SELECT m.id, snippet(api_message_fts, 0, '[', ']', '...', 12)
+        FROM api_message_fts
+        JOIN {Message._meta.db_table} m ON m.id = api_message_fts.rowid
+        JOIN {members} cu ON cu.conversation_id = m.to_conversation_id_id AND cu.user_id = %s
+        WHERE api_message_fts MATCH %s
+        ORDER BY api_message_fts.rank
+        LIMIT %s OFFSET %s
+    """, [user_id, match_expression(words), limit, offset])
+    return _in_rank_order(messages, hits)
+
+
+def search_events(words, limit, offset):
+    events = Event.objects.values(*EVENT_FIELDS, **EVENT_ALIASES)
+
+    if connection.vendor != "sqlite":
+        events = events.filter(_like(words, ["name", "description"]))
+        return [{**event, "snippet": event["description"]} for event in events.order_by("-id")[offset:offset + limit]]
+
+    # Hits in the name weigh ten times more than in the description
+    hits = _fts("""
+        SELECT rowid, snippet(api_event_fts, 1, '[', ']', '...', 12)
+        FROM api_event_fts
+        WHERE api_event_fts MATCH %s
+        ORDER BY bm25(api_event_fts, 10.0, 1.0)
+        LIMIT %s OFFSET %s
+    """, [match_expression(words), limit, offset])
+    return _in_rank_order(events, hits, key="event_id")
+
+
+def search_users(words, limit, offset):
+    users = User.objects.values(*USER_FIELDS)
+
+    if connection.vendor != "sqlite":
+        users = users.filter(_like(words, ["first_name", "last_name"]))
+        return [{**user, "snippet": None} for user in users.order_by("first_name", "id")[offset:offset + limit]]
+
+    hits = _fts("""
+        SELECT rowid, NULL
+        FROM api_user_fts
+        WHERE api_user_fts MATCH %s
+        ORDER BY api_user_fts.rank
+        LIMIT %s OFFSET %s
+    """, [match_expression(words), limit, offset])
+    return _in_rank_order(users, hits)
@@ -0,0 +1,157 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, post_migrate, m2m_changed
+from django.db.models import Q
+from django.dispatch import receiver
+
+from . import feed, search, typeahead
+from .cache import bump_version, invalidate_profile
+from .models import User, Location, UserRefs, Event, EventFeedEntry, Conversation, ReadCursor
+
+
+@receiver([post_save, post_delete], sender=Location)
+@receiver([post_save, post_delete], sender=UserRefs)
+@receiver([post_save, post_delete], sender=Event)
+def invalidate_map_clusters(sender, **kwargs):
+    # Cluster tiles are cached per map version, any marker change makes them stale.
+    # Bumped once committed, or a request in between would cache the old markers again
+    transaction.on_commit(lambda: bump_version("map"))
+
+
+@receiver([post_save, post_delete], sender=Event)
+@receiver(m2m_changed, sender=Event.users.through)
+def invalidate_event_responses(sender, **kwargs):
+    # Covers CreateEventView (new event) and JoinEventView (attendee added)
+    transaction.on_commit(lambda: bump_version("events"))
+
+
+@receiver(post_save, sender=Location)
+def invalidate_event_responses_on_move(sender, instance, created, **kwargs):
+    # Only event locations are listed, homes moving are handled by SetUserLocationView.
+    # Deleting a location deletes its events, which bump on their own.
+    if not created and Event.objects.filter(location_id=instance).exists():
+        transaction.on_commit(lambda: bump_version("events"))
+
+
+@receiver(m2m_changed, sender=Event.users.through)
+def sync_event_feeds(sender, instance, action, reverse, pk_set, **kwargs):
+    # Joined events leave the attendee's feed and come back when they leave. Covers every
+    # users.add/remove/clear, the batch endpoints' bulk writes update the feeds themselves.
+    if action == "post_clear":
+        if not reverse:
+            feed.add_event(instance)
+        else:
+            home = UserRefs.objects.current().filter(user_id=instance).select_related("location_id").first()
+            if home is not None:
+                feed.rebuild_user(instance.pk, home.location_id)
+        return
+    if action not in ("post_add", "post_remove") or not pk_set:
+        return
+
+    if reverse:
+        events, user_ids = Event.objects.filter(id__in=pk_set).select_related("location_id"), [instance.pk]
+    else:
+        events, user_ids = [instance], pk_set
+    for event in events:
+        if action == "post_add":
+            feed.remove_event(event, user_ids)
+        else:
+            feed.add_event(event, user_ids)
+
+
+NAME_FIELDS = ("first_name", "last_name")
+
+
+@receiver(pre_save, sender=User)
+def remember_saved_name(sender, instance, update_fields=None, **kwargs):
+    # Lets post_save tell a rename from logins, password changes and saves of an unchanged name
+    instance._saved_name = None
+    if not instance._state.adding and (update_fields is None or set(NAME_FIELDS) & set(update_fields)):
+        instance._saved_name = User.objects.filter(pk=instance.pk).values_list(*NAME_FIELDS).first()
+
+
+def renamed(user):
+    saved_name = getattr(user, "_saved_name", None)
+    return saved_name is not None and saved_name != (user.first_name, user.last_name)
+
+
+@receiver(post_save, sender=User)
+def invalidate_event_responses_on_rename(sender, instance, created, **kwargs):
+    # Event listings embed owner and attendee names, new users aren't in any of them yet
+    if not created and renamed(instance):
+        transaction.on_commit(lambda: bump_version("events"))
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_locations_on_rename(sender, instance, created, **kwargs):
+    # The user locations listing has every user's name
+    if created or renamed(instance):
+        transaction.on_commit(lambda: bump_version("users"))
+
+
+@receiver([post_save, post_delete], sender=UserRefs)
+@receiver(post_delete, sender=User)
+def invalidate_user_locations(sender, **kwargs):
+    # SetUserLocationView touches the UserRefs row whenever it saves a home
+    transaction.on_commit(lambda: bump_version("users"))
+
+
+@receiver(post_save, sender=Location)
+def invalidate_user_locations_on_move(sender, instance, created, **kwargs):
+    # Homes edited directly, e.g. from the admin
+    if not created and UserRefs.objects.current().filter(location_id=instance).exists():
+        transaction.on_commit(lambda: bump_version("users"))
+
+
+@receiver(post_save, sender=User)
+@receiver([post_save, post_delete], sender=UserRefs)
+def invalidate_cached_profile(sender, instance, **kwargs):
+    # SetUserLocationView invalidates explicitly, this also covers the admin and shell
+    invalidate_profile(instance.pk if sender is User else instance.user_id_id)
+
+
+@receiver(post_save, sender=Event)
+def sync_event_feed_dates(sender, instance, created, **kwargs):
+    # Feed entries copy the event date, keep them in step when an event is rescheduled
+    if not created:
+        EventFeedEntry.objects.filter(event_id=instance).exclude(date=instance.date).update(date=instance.date)
+
+
+@receiver(post_save, sender=User)
+def index_user_name(sender, instance, update_fields=None, **kwargs):
+    # Typeahead tokens follow the name, logins and password changes don't touch it
+    if update_fields is None or {"first_name", "last_name"} & set(update_fields):
+        typeahead.index_user(instance)
+
+
+@receiver(m2m_changed, sender=Conversation.users.through)
+def sync_read_cursors(sender, instance, action, reverse, pk_set, **kwargs):
+    # Every member has a read cursor, new members start with the existing history read
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if reverse:
+        pairs = [(instance.pk, conversation_id) for conversation_id in pk_set or ()]
+    else:
+        pairs = [(user_id, instance.pk) for user_id in pk_set or ()]
+
+    if action == "post_add":
+        last_messages = dict(Conversation.objects.filter(id__in={c for _, c in pairs}).values_list("id", "last_message_id"))
+        ReadCursor.objects.bulk_create(
+            [ReadCursor(user_id_id=user_id, conversation_id_id=conversation_id, last_read_message_id=last_messages[conversation_id])
+             for user_id, conversation_id in pairs],
+            ignore_conflicts=True,
+        )
+    elif action == "post_remove":
+        removed = Q()
+        for user_id, conversation_id in pairs:
+            removed |= Q(user_id=user_id, conversation_id=conversation_id)
+        if removed:
+            ReadCursor.objects.filter(removed).delete()
+    else:
+        ReadCursor.objects.filter(**{"user_id" if reverse else "conversation_id": instance}).delete()
+
+
+@receiver(post_migrate)
+def restore_search_indexes(sender, using, **kwargs):
+    # Table rebuilds during migrate drop the FTS triggers, put them back once api is migrated
+    if sender.name == "api":
+        search.ensure_indexes(using)
@@ -1,3 +1,1630 @@
-from django.test import TestCase
+import asyncio
+import copy
+import io
+import json
+import os
+import re
+import time
+import warnings
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.base import CacheKeyWarning
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncClient, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.http import http_date
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory
+
+from .conditional import conditional_response
+from .consumers import conversation_socket
+from . import geo, search, typeahead
+from .messaging import post_message, post_messages
+from .models import User, Message, Conversation, Location, Event, UserRefs, EventFeedEntry, ArchivedEvent, ReadCursor, UserNameToken
 
 # Create your tests here.
+
+class APITestCase(TestCase):
+
+    def setUp(self):
+        # Cached responses and versions outlive the rolled back test data
+        cache.clear()
+        self.client = APIClient()
+
+    def set_home(self, user, latitude, longitude):
+        response = self.client.post("/api/setUserLocation/", {
+            "user_id": user.id,
+            "city": "Toronto",
+            "country": "Canada",
+            "region": "Ontario",
+            "latitude": latitude,
+            "longitude": longitude,
+            "latitude_delta": 0.1,
+            "longitude_delta": 0.1,
+        })
+        self.assertEqual(response.status_code, 201)
+
+    @cached_property
+    def owner(self):
+        # Default organiser of the events made by create_event()
+        return User.objects.create_user(username="owner", password="pw", first_name="Olive")
+
+    def create_location(self, latitude=43.65, longitude=-79.38, **fields):
+        return Location.objects.create(latitude=latitude, longitude=longitude, latitude_delta=0, longitude_delta=0, **fields)
+
+    def create_event(self, name="Event", latitude=43.65, longitude=-79.38, days=1, owner=None, location=None):
+        return Event.objects.create(owner_id=owner or self.owner, name=name, description="",
+                                    location_id=location or self.create_location(latitude, longitude),
+                                    date=timezone.now() + timedelta(days=days))
+
+
+class ConversationMessagesTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user(username="alice", password="pw", first_name="Alice")
+        self.bob = User.objects.create_user(username="bob", password="pw", first_name="Bob")
+        self.conversation = Conversation.objects.create(name="Neighbours")
+        self.conversation.users.add(self.alice, self.bob)
+
+    def send(self, user, content):
+        return Message.objects.create(content=content, from_user_id=user, to_conversation_id=self.conversation)
+
+    def get_messages(self, **params):
+        return self.client.get(f"/api/getConversationMessages/{self.conversation.id}/", params)
+
+    def test_after_id_returns_only_newer_messages(self):
+        first = self.send(self.alice, "hello")
+        self.send(self.bob, "hi")
+        self.send(self.alice, "how are you?")
+
+        response = self.get_messages(after_id=first.id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m["content"] for m in response.data], ["hi", "how are you?"])
+        self.assertEqual(response.data[0]["sender_first_name"], "Bob")
+
+    def test_after_id_idle_poll_is_empty(self):
+        last = self.send(self.alice, "hello")
+
+        with self.assertNumQueries(1):
+            response = self.get_messages(after_id=last.id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [])
+
+    def test_listing_runs_in_constant_queries(self):
+        for i in range(50):
+            self.send(self.alice if i % 2 else self.bob, f"message {i}")
+
+        # Version fingerprint + listing
+        with self.assertNumQueries(2):
+            response = self.get_messages()
+
+        self.assertEqual(len(response.data), 50)
+        self.assertEqual(response.data[0]["sender_first_name"], "Bob")
+        self.assertEqual(response.data[1]["sender_first_name"], "Alice")
+        self.assertEqual(response.data[1]["from_user_id"], self.alice.id)
+        self.assertEqual(response.data[1]["to_conversation_id"], self.conversation.id)
+
+    def test_limit_returns_newest_page_oldest_first(self):
+        for i in range(10):
+            self.send(self.alice, f"message {i}")
+
+        response = self.get_messages(limit=3)
+
+        self.assertEqual([m["content"] for m in response.data], ["message 7", "message 8", "message 9"])
+
+    def test_before_id_seeks_backwards(self):
+        messages = [self.send(self.alice, f"message {i}") for i in range(10)]
+        # Equal timestamps must still page deterministically by id
+        Message.objects.filter(id__in=[m.id for m in messages[2:6]]).update(timestamp=messages[2].timestamp)
+
+        response = self.get_messages(before_id=messages[5].id, limit=3)
+        self.assertEqual([m["content"] for m in response.data], ["message 2", "message 3", "message 4"])
+
+        response = self.get_messages(before_id=response.data[0]["id"], limit=3)
+        self.assertEqual([m["content"] for m in response.data], ["message 0", "message 1"])
+
+    def test_after_id_must_be_numeric(self):
+        response = self.get_messages(after_id="abc")
+        self.assertEqual(response.status_code, 400)
+
+
+class ConversationSocketTests(TransactionTestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice", password="pw", first_name="Alice")
+        self.conversation = Conversation.objects.create(name="Neighbours")
+        self.conversation.users.add(self.alice)
+
+    async def connect(self, path):
+        inbox, outbox = asyncio.Queue(), asyncio.Queue()
+        task = asyncio.ensure_future(conversation_socket({"type": "websocket", "path": path}, inbox.get, outbox.put))
+        await inbox.put({"type": "websocket.connect"})
+        return task, inbox, outbox
+
+    async def test_new_messages_are_pushed(self):
+        task, inbox, outbox = await self.connect(f"/ws/conversations/{self.conversation.id}/")
+        self.assertEqual((await outbox.get())["type"], "websocket.accept")
+
+        await sync_to_async(APIClient().post)("/api/sendMessage/", {
+            "content": "hello",
+            "from_user_id": self.alice.id,
+            "to_conversation_id": self.conversation.id,
+        })
+
+        frame = await asyncio.wait_for(outbox.get(), timeout=1)
+        payload = json.loads(frame["text"])
+        self.assertEqual(payload["content"], "hello")
+        self.assertEqual(payload["sender_first_name"], "Alice")
+        rest = await sync_to_async(APIClient().get)(f"/api/getConversationMessages/{self.conversation.id}/")
+        self.assertEqual(payload, json.loads(rest.content)[0])
+
+        await inbox.put({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.wait_for(task, timeout=1)
+
+    async def test_unknown_conversation_is_rejected(self):
+        task, inbox, outbox = await self.connect("/ws/conversations/999/")
+        self.assertEqual((await outbox.get())["type"], "websocket.close")
+        await asyncio.wait_for(task, timeout=1)
+
+
+class LoadConversationsTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user(username="alice", password="pw", first_name="Alice")
+        self.bob = User.objects.create_user(username="bob", password="pw", first_name="Bob")
+
+    def create_conversation(self, name):
+        conversation = Conversation.objects.create(name=name)
+        conversation.users.add(self.alice, self.bob)
+        return conversation
+
+    def send(self, conversation, content):
+        return self.client.post("/api/sendMessage/", {
+            "content": content,
+            "from_user_id": self.alice.id,
+            "to_conversation_id": conversation.id,
+        })
+
+    def test_inbox_is_one_query_sorted_by_recency(self):
+        quiet = self.create_conversation("Quiet")
+        older = self.create_conversation("Older")
+        newer = self.create_conversation("Newer")
+        self.send(older, "first")
+        self.send(newer, "second")
+        self.send(older, "third")
+
+        # Version fingerprint + inbox
+        with self.assertNumQueries(2):
+            response = self.client.get(f"/api/loadConversations/{self.bob.id}/")
+
+        self.assertEqual([c["conversation_id"] for c in response.data], [older.id, newer.id, quiet.id])
+        self.assertEqual(response.data[0]["preview"], "third")
+        self.assertEqual(response.data[2]["preview"], "No messages yet")
+        self.assertIsNone(response.data[2]["timestamp"])
+
+    def test_backfill_command_sets_last_message(self):
+        conversation = self.create_conversation("Legacy")
+        Message.objects.create(content="old", from_user_id=self.alice, to_conversation_id=conversation)
+        latest = Message.objects.create(content="new", from_user_id=self.bob, to_conversation_id=conversation)
+
+        call_command("backfill_conversation_previews", stdout=io.StringIO())
+
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.last_message_id, latest.id)
+        self.assertEqual(conversation.last_message_at, latest.timestamp)
+
+
+class EventViewportTests(APITestCase):
+
+    def event_names(self, **params):
+        response = self.client.get("/api/getAllEventLocations/", params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(event["event_name"] for event in response.data)
+
+    def test_bounding_box(self):
+        self.create_event("Toronto", 43.65, -79.38)
+        self.create_event("Mississauga", 43.59, -79.64)
+        self.create_event("Montreal", 45.50, -73.57)
+
+        names = self.event_names(min_lat=43.5, max_lat=43.8, min_lng=-79.5, max_lng=-79.2)
+
+        self.assertEqual(names, ["Toronto"])
+
+    def test_center_and_deltas(self):
+        self.create_event("Toronto", 43.65, -79.38)
+        self.create_event("Montreal", 45.50, -73.57)
+
+        names = self.event_names(latitude=43.7, longitude=-79.4, latitude_delta=0.2, longitude_delta=0.2)
+
+        self.assertEqual(names, ["Toronto"])
+
+    def test_bulk_written_locations(self):
+        moved = self.create_event("Moved", 45.50, -73.57)
+        location, = Location.objects.bulk_create([Location(latitude=43.65, longitude=-79.38, latitude_delta=0, longitude_delta=0)])
+        self.create_event("Bulk", location=location)
+        Location.objects.filter(id=moved.location_id_id).update(latitude=43.66, longitude=-79.39)
+        toronto = {"min_lat": 43.5, "max_lat": 43.8, "min_lng": -79.5, "max_lng": -79.2}
+
+        # Moved by update(), which can't compute the cell, so it is matched on its coordinates
+        self.assertIsNone(Location.objects.get(id=moved.location_id_id).geocell)
+        self.assertEqual(self.event_names(**toronto), ["Bulk", "Moved"])
+
+        self.assertEqual(Location.objects.fill_geocells(), 1)
+        self.assertEqual(Location.objects.get(id=moved.location_id_id).geocell, geo.geocell(43.66, -79.39))
+        cache.clear()
+        self.assertEqual(self.event_names(**toronto), ["Bulk", "Moved"])
+
+    def test_large_and_antimeridian_viewports(self):
+        self.create_event("Fiji", -17.7, 178.0)
+        self.create_event("Samoa", -13.8, -172.1)
+        self.create_event("Toronto", 43.65, -79.38)
+
+        self.assertEqual(self.event_names(min_lat=-20, max_lat=-10, min_lng=175, max_lng=-170), ["Fiji", "Samoa"])
+        self.assertEqual(self.event_names(min_lat=-90, max_lat=90, min_lng=-180, max_lng=180), ["Fiji", "Samoa", "Toronto"])
+
+    def test_no_viewport_returns_everything(self):
+        self.create_event("Toronto", 43.65, -79.38)
+        self.create_event("Montreal", 45.50, -73.57)
+
+        self.assertEqual(self.event_names(), ["Montreal", "Toronto"])
+
+    def test_invalid_viewport(self):
+        response = self.client.get("/api/getAllEventLocations/", {"min_lat": 1, "max_lat": 2})
+        self.assertEqual(response.status_code, 400)
+
+    def test_non_finite_and_out_of_range_viewports(self):
+        for viewport in (
+            {"min_lat": 40, "max_lat": 50, "min_lng": "-inf", "max_lng": -70},
+            {"min_lat": 40, "max_lat": 50, "min_lng": -85, "max_lng": "nan"},
+            {"min_lat": 40, "max_lat": 50, "min_lng": -85, "max_lng": 200},
+            {"latitude": 43.65, "longitude": -79.38, "latitude_delta": "inf", "longitude_delta": 1},
+            {"latitude": 43.65, "longitude": 1e300, "latitude_delta": 1, "longitude_delta": 1},
+        ):
+            response = self.client.get("/api/getAllEventLocations/", viewport)
+            self.assertEqual(response.status_code, 400, viewport)
+
+    def test_geocell_is_kept_in_sync(self):
+        location = self.create_location()
+        location.latitude = 45.5
+        location.save(update_fields=["latitude"])
+
+        location.refresh_from_db()
+        self.assertEqual(location.geocell, geo.geocell(45.5, -79.38))
+
+
+class NearbyTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.me = self.create_user("me", 43.6532, -79.3832)  # Toronto city hall
+
+    def create_user(self, name, latitude, longitude):
+        user = User.objects.create_user(username=name, password="pw", first_name=name)
+        self.set_home(user, latitude, longitude)
+        return user
+
+    def create_event(self, name, latitude, longitude, days=1):
+        return super().create_event(name, latitude, longitude, days=days, owner=self.me)
+
+    def test_haversine(self):
+        # Toronto to Montreal is roughly 504 km
+        self.assertAlmostEqual(geo.haversine_km(43.6532, -79.3832, 45.5017, -73.5673), 504, delta=3)
+
+    def test_events_within_radius_sorted_by_distance(self):
+        self.create_event("Far", 43.70, -79.42)       # ~6 km
+        self.create_event("Near", 43.655, -79.385)    # ~0.2 km
+        self.create_event("Montreal", 45.50, -73.57)
+        joined = self.create_event("Joined", 43.654, -79.384)
+        joined.users.add(self.me)
+        self.create_event("Past", 43.6533, -79.3833, days=-1)
+
+        response = self.client.get(f"/api/getNearbyEvents/{self.me.id}/", {"radius_km": 10})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([e["name"] for e in response.data], ["Near", "Far"])
+        self.assertLess(response.data[0]["distance_km"], response.data[1]["distance_km"])
+
+    def test_k_nearest_users_expands_search(self):
+        self.create_user("hamilton", 43.2557, -79.8711)  # ~60 km
+        self.create_user("oshawa", 43.8971, -78.8658)    # ~48 km
+        self.create_user("montreal", 45.5017, -73.5673)  # ~504 km
+        moved = self.create_user("moved", 45.5, -73.5)
+        self.set_home(moved, 43.66, -79.39)
+
+        response = self.client.get(f"/api/getNearbyUsers/{self.me.id}/", {"limit": 3, "radius_km": 500})
+
+        self.assertEqual([u["owner_first_name"] for u in response.data], ["moved", "oshawa", "hamilton"])
+
+    def test_user_without_home(self):
+        homeless = User.objects.create_user(username="homeless", password="pw")
+        response = self.client.get(f"/api/getNearbyUsers/{homeless.id}/")
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_radius(self):
+        response = self.client.get(f"/api/getNearbyEvents/{self.me.id}/", {"radius_km": "-1"})
+        self.assertEqual(response.status_code, 400)
+
+
+class MapClustersTests(APITestCase):
+
+    def get_clusters(self, **params):
+        params = {"zoom": 6, "min_lat": 40, "max_lat": 50, "min_lng": -85, "max_lng": -70, **params}
+        return self.client.get("/api/getMapClusters/", params)
+
+    def test_nearby_points_are_aggregated(self):
+        self.create_event(latitude=43.65, longitude=-79.38)
+        self.create_event(latitude=43.66, longitude=-79.39)
+        self.create_event(latitude=45.50, longitude=-73.57)
+
+        response = self.get_clusters()
+
+        self.assertEqual(response.status_code, 200)
+        clusters = sorted(response.data, key=lambda cluster: cluster["count"])
+        self.assertEqual([cluster["count"] for cluster in clusters], [1, 2])
+        self.assertAlmostEqual(clusters[1]["latitude"], 43.655)
+        self.assertEqual((clusters[1]["min_lat"], clusters[1]["max_lat"]), (43.65, 43.66))
+
+    def test_point_on_tile_edge_is_counted_once(self):
+        # 0 degrees is a tile edge at every zoom level
+        self.create_event(latitude=0, longitude=0)
+
+        response = self.get_clusters(zoom=4, min_lat=-10, max_lat=10, min_lng=-10, max_lng=10)
+
+        self.assertEqual([cluster["count"] for cluster in response.data], [1])
+
+    def test_tiles_are_cached_until_a_location_changes(self):
+        self.create_event(latitude=43.65, longitude=-79.38)
+        self.get_clusters()
+
+        with self.assertNumQueries(0):
+            self.get_clusters()
+
+        # The version is only bumped once the change is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_event(latitude=43.66, longitude=-79.39)
+            with self.assertNumQueries(0):
+                self.get_clusters()
+        response = self.get_clusters()
+        self.assertEqual([cluster["count"] for cluster in response.data], [2])
+
+    def test_past_events_are_not_clustered(self):
+        self.create_event(latitude=43.65, longitude=-79.38)
+        self.create_event(latitude=43.66, longitude=-79.39, days=-1)
+
+        self.assertEqual([cluster["count"] for cluster in self.get_clusters().data], [1])
+        self.assertEqual(self.get_clusters(horizon_days="soon").status_code, 400)
+
+    def test_users_layer_uses_latest_home(self):
+        neighbour = User.objects.create_user(username="neighbour", password="pw")
+        self.set_home(neighbour, 45.50, -79.38)
+        self.set_home(neighbour, 43.65, -79.38)
+
+        response = self.get_clusters(layer="users")
+
+        self.assertEqual([(cluster["count"], cluster["latitude"]) for cluster in response.data], [(1, 43.65)])
+
+    def test_too_many_tiles(self):
+        response = self.get_clusters(zoom=12)
+        self.assertEqual(response.status_code, 400)
+
+    def test_non_finite_and_out_of_range_viewports(self):
+        for viewport in ({"min_lng": "-inf"}, {"max_lat": "inf"}, {"max_lng": "nan"}, {"min_lng": -181}):
+            response = self.get_clusters(zoom=0, **viewport)
+            self.assertEqual(response.status_code, 400, viewport)
+
+
+class EventListingQueryTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username="owner", password="pw", first_name="Olive")
+        cls.attendees = [User.objects.create_user(username=f"user{i}", password="pw", first_name=f"User{i}")
+                         for i in range(3)]
+        locations = Location.objects.bulk_create(
+            Location(latitude=43.6, longitude=-79.4, latitude_delta=0, longitude_delta=0) for _ in range(1000)
+        )
+        events = Event.objects.bulk_create(
+            Event(owner_id=cls.owner, name=f"Event {i}", description="", date=timezone.now() + timedelta(days=1), location_id=location)
+            for i, location in enumerate(locations)
+        )
+        Event.users.through.objects.bulk_create(
+            Event.users.through(event_id=event.id, user_id=attendee.id)
+            for i, event in enumerate(events) for attendee in cls.attendees[:i % 3]
+        )
+
+    def setUp(self):
+        super().setUp()
+
+    def test_all_event_locations_query_count(self):
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/getAllEventLocations/")
+
+        self.assertEqual(len(response.data), 1000)
+        self.assertEqual(response.data[2]["users"], ["User0", "User1"])
+        self.assertEqual(response.data[2]["attendee_count"], 2)
+        self.assertEqual(response.data[2]["owner_first_name"], "Olive")
+
+    def test_available_events_query_count(self):
+        # home check, events, attendee names
+        with self.assertNumQueries(3):
+            response = self.client.get(f"/api/getAvailableEvents/{self.attendees[1].id}/", {"limit": 200})
+
+        # Every third event has no attendees and every other third only has User0
+        self.assertEqual(len(response.data), 200)
+        self.assertEqual([event["attendee_count"] for event in response.data[:3]], [0, 1, 0])
+
+    def test_attendee_count_only(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/getAllEventLocations/", {"attendees": "count"})
+
+        self.assertNotIn("users", response.data[0])
+        self.assertEqual(sorted({event["attendee_count"] for event in response.data}), [0, 1, 2])
+
+
+class CompactFormatTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        for latitude, longitude in ((43.65, -79.38), (43.66123, -79.39)):
+            self.create_event(f"Event {latitude}", latitude, longitude)
+
+    def decode_coordinates(self, column):
+        values, total = [], 0
+        for delta in column:
+            total += delta
+            values.append(total / 10 ** 5)
+        return values
+
+    def test_format_query_param(self):
+        response = self.client.get("/api/getAllEventLocations/", {"format": "compact"})
+        payload = json.loads(response.content)
+
+        self.assertEqual(payload["count"], 2)
+        self.assertEqual(payload["constants"]["latitude_delta"], 0)
+        self.assertEqual(payload["constants"]["owner_first_name"], "Olive")
+        self.assertEqual(payload["columns"]["event_name"], ["Event 43.65", "Event 43.66123"])
+        self.assertEqual(self.decode_coordinates(payload["columns"]["latitude"]), [43.65, 43.66123])
+        self.assertEqual(payload["encodings"]["latitude"], "delta/100000")
+
+    def test_accept_header(self):
+        response = self.client.get("/api/getAllEventLocations/", HTTP_ACCEPT="application/vnd.chd.compact+json")
+
+        self.assertEqual(response["Content-Type"], "application/vnd.chd.compact+json")
+        self.assertEqual(json.loads(response.content)["count"], 2)
+
+    def test_plain_json_by_default(self):
+        response = self.client.get("/api/getAllEventLocations/")
+        self.assertEqual(len(json.loads(response.content)), 2)
+
+    def test_errors_are_not_reshaped(self):
+        response = self.client.get("/api/getAllEventLocations/", {"format": "compact", "min_lat": "x"})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("error", json.loads(response.content))
+
+
+class EventResponseCacheTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.guest = User.objects.create_user(username="guest", password="pw", first_name="Gus")
+        self.event = self.create_event("Picnic")
+
+    def test_repeated_requests_are_served_from_cache(self):
+        first = self.client.get("/api/getAllEventLocations/")
+
+        with self.assertNumQueries(0):
+            second = self.client.get("/api/getAllEventLocations/")
+
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first["ETag"], second["ETag"])
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get(f"/api/getAvailableEvents/{self.guest.id}/")["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(f"/api/getAvailableEvents/{self.guest.id}/", HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_join_invalidates_cached_responses(self):
+        before = self.client.get(f"/api/getAvailableEvents/{self.guest.id}/")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/api/joinEvent/", {"user_id": self.guest.id, "event_id": self.event.id})
+
+        after = self.client.get(f"/api/getAvailableEvents/{self.guest.id}/", HTTP_IF_NONE_MATCH=before["ETag"])
+        self.assertEqual(after.status_code, 200)
+        self.assertEqual(after.data, [])
+        self.assertEqual(self.client.get("/api/getAllEventLocations/").data[0]["users"], ["Gus"])
+
+    def test_only_relevant_writes_invalidate_cached_responses(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.set_home(self.guest, 43.65, -79.38)
+        etag = self.client.get("/api/getAllEventLocations/")["ETag"]
+
+        def still_cached():
+            return self.client.get("/api/getAllEventLocations/", HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.set_home(self.guest, 43.65, -79.38)
+            User.objects.create_user(username="newcomer", password="pw")
+            self.guest.save()
+        self.assertTrue(still_cached())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.owner.first_name = "Olivia"
+            self.owner.save()
+        self.assertFalse(still_cached())
+        self.assertEqual(self.client.get("/api/getAllEventLocations/").data[0]["owner_first_name"], "Olivia")
+
+    def test_moving_an_event_invalidates_cached_responses(self):
+        etag = self.client.get("/api/getAllEventLocations/")["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.event.location_id.latitude = 43.7
+            self.event.location_id.save()
+
+        response = self.client.get("/api/getAllEventLocations/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_representations_have_distinct_etags(self):
+        plain = self.client.get("/api/getAllEventLocations/")
+        compact = self.client.get("/api/getAllEventLocations/", HTTP_ACCEPT="application/vnd.chd.compact+json")
+
+        self.assertNotEqual(plain["ETag"], compact["ETag"])
+
+
+class ConditionalGetTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user(username="alice", password="pw", first_name="Alice")
+        self.conversation = Conversation.objects.create(name="Neighbours")
+        self.conversation.users.add(self.alice)
+        self.set_home(self.alice, 43.65, -79.38)
+        Message.objects.create(content="hello", from_user_id=self.alice, to_conversation_id=self.conversation)
+
+    def send(self, content):
+        self.client.post("/api/sendMessage/", {
+            "content": content,
+            "from_user_id": self.alice.id,
+            "to_conversation_id": self.conversation.id,
+        })
+
+    def assertRevalidates(self, url, change, queries=1):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        # Only the version fingerprint runs for an unchanged resource
+        with self.assertNumQueries(queries):
+            unchanged = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(unchanged.status_code, 304)
+        self.assertEqual(unchanged["ETag"], response["ETag"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], response["ETag"])
+
+    def test_conversation_messages(self):
+        self.assertRevalidates(f"/api/getConversationMessages/{self.conversation.id}/", lambda: self.send("hi"))
+
+    def test_load_conversations(self):
+        self.assertRevalidates(f"/api/loadConversations/{self.alice.id}/", lambda: self.send("hi"))
+
+    def test_user_locations(self):
+        def new_neighbour():
+            self.set_home(User.objects.create_user(username="bob", password="pw"), 43.66, -79.39)
+
+        # The version lives in the cache, a 304 needs no query at all
+        self.assertRevalidates(f"/api/getAllUserLocations/{self.alice.id}/", new_neighbour, queries=0)
+
+    def test_user_locations_follow_renames(self):
+        def rename():
+            self.bob.first_name = "Robert"
+            self.bob.save()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bob = User.objects.create_user(username="bob", password="pw", first_name="Bob")
+            self.set_home(self.bob, 43.66, -79.39)
+        self.assertRevalidates(f"/api/getAllUserLocations/{self.alice.id}/", rename, queries=0)
+        response = self.client.get(f"/api/getAllUserLocations/{self.alice.id}/")
+        self.assertEqual(response.data[0]["owner_first_name"], "Robert")
+
+    def test_if_modified_since(self):
+        last_modified = timezone.now()
+
+        def get(**headers):
+            request = Request(APIRequestFactory().get("/resource/", **headers))
+            return conditional_response(request, (1,), lambda: Response([]), last_modified=last_modified)
+
+        # Same second as the newest change, which may have been written after the response
+        self.assertEqual(get(HTTP_IF_MODIFIED_SINCE=get()["Last-Modified"]).status_code, 200)
+
+        later = http_date(time.time() + 1)
+        self.assertEqual(get(HTTP_IF_MODIFIED_SINCE=later).status_code, 304)
+
+    def test_polled_endpoints_ignore_if_modified_since(self):
+        for url in (f"/api/getConversationMessages/{self.conversation.id}/", f"/api/loadConversations/{self.alice.id}/"):
+            self.send("hi")
+            first = self.client.get(url)
+            self.assertNotIn("Last-Modified", first)
+
+            # A second message within the same second is still picked up
+            self.send("again")
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 1))
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], first["ETag"])
+
+
+class UserProfileTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user(username="alice", password="pw", first_name="Alice")
+
+    def test_default_home(self):
+        response = self.client.get(f"/api/getUserInfo/{self.alice.id}/")
+
+        self.assertEqual(response.data["first_name"], "Alice")
+        self.assertEqual(response.data["city"], "Toronto")
+
+    def test_profile_is_cached_until_home_changes(self):
+        self.set_home(self.alice, 43.65, -79.38)
+        self.client.get(f"/api/getUserInfo/{self.alice.id}/")
+
+        with self.assertNumQueries(0):
+            response = self.client.get(f"/api/getUserInfo/{self.alice.id}/")
+        self.assertEqual(response.data["latitude"], 43.65)
+
+        self.set_home(self.alice, 45.5, -73.57)
+        response = self.client.get(f"/api/getUserInfo/{self.alice.id}/")
+        self.assertEqual(response.data["latitude"], 45.5)
+
+    def test_profile_is_invalidated_on_rename(self):
+        self.client.get(f"/api/getUserInfo/{self.alice.id}/")
+
+        self.alice.first_name = "Alicia"
+        self.alice.save()
+
+        self.assertEqual(self.client.get(f"/api/getUserInfo/{self.alice.id}/").data["first_name"], "Alicia")
+
+    def test_unknown_user(self):
+        self.assertEqual(self.client.get("/api/getUserInfo/999/").status_code, 400)
+
+    def test_user_locations_are_one_join(self):
+        for i in range(20):
+            user = User.objects.create_user(username=f"user{i}", password="pw")
+            self.set_home(user, 43 + i / 100, -79.38)
+            self.set_home(user, 44 + i / 100, -79.38)
+
+        # One join over users and their current homes, the version comes from the cache
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/getAllUserLocations/{self.alice.id}/")
+
+        self.assertEqual(len(response.data), 20)
+        self.assertTrue(all(user["latitude"] >= 44 for user in response.data))
+
+    def test_only_one_current_home(self):
+        self.set_home(self.alice, 43.65, -79.38)
+        self.set_home(self.alice, 45.5, -73.57)
+
+        self.assertEqual(UserRefs.objects.current().filter(user_id=self.alice).count(), 1)
+
+
+class UserLocationUpsertTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user(username="alice", password="pw", first_name="Alice")
+
+    def test_moving_updates_the_home_in_place(self):
+        self.set_home(self.alice, 43.65, -79.38)
+        self.set_home(self.alice, 45.5, -73.57)
+        self.set_home(self.alice, 45.5, -73.57)
+
+        self.assertEqual(UserRefs.objects.count(), 1)
+        self.assertEqual(Location.objects.count(), 1)
+        self.assertEqual(Location.objects.get().geocell, geo.geocell(45.5, -73.57))
+
+    def test_concurrent_first_insert_becomes_an_update(self):
+        self.set_home(self.alice, 43.65, -79.38)
+        current = UserRefs.objects.current
+        misses = [UserRefs.objects.none()]
+
+        # The first lookup misses the home another request has just created
+        with mock.patch.object(UserRefs.objects, "current", side_effect=lambda: misses.pop() if misses else current()):
+            self.set_home(self.alice, 45.5, -73.57)
+
+        self.assertEqual(UserRefs.objects.count(), 1)
+        self.assertEqual(Location.objects.get().latitude, 45.5)
+
+    def test_move_changes_user_locations_etag(self):
+        bob = User.objects.create_user(username="bob", password="pw")
+        self.set_home(bob, 43.65, -79.38)
+        etag = self.client.get(f"/api/getAllUserLocations/{self.alice.id}/")["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.set_home(bob, 45.5, -73.57)
+
+        response = self.client.get(f"/api/getAllUserLocations/{self.alice.id}/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]["latitude"], 45.5)
+
+    def test_compaction_command(self):
+        def home(latitude, is_current):
+            location = Location.objects.create(latitude=latitude, longitude=-79.38, latitude_delta=0, longitude_delta=0)
+            return UserRefs.objects.create(user_id=self.alice, location_id=location, is_current=is_current)
+
+        # History left behind by the old append-only writes
+        home(43.1, False)
+        current = home(43.2, True)
+        bob = User.objects.create_user(username="bob", password="pw")
+        UserRefs.objects.create(user_id=bob, is_current=False, location_id=Location.objects.create(
+            latitude=44, longitude=-79, latitude_delta=0, longitude_delta=0))
+        bob_latest = UserRefs.objects.create(user_id=bob, is_current=False, location_id=Location.objects.create(
+            latitude=45, longitude=-79, latitude_delta=0, longitude_delta=0))
+        event_location = Location.objects.create(latitude=40, longitude=-79, latitude_delta=0, longitude_delta=0)
+        Event.objects.create(owner_id=bob, name="Picnic", description="", location_id=event_location)
+        Location.objects.create(latitude=41, longitude=-79, latitude_delta=0, longitude_delta=0)
+
+        call_command("compact_user_locations", "--dry-run", stdout=io.StringIO())
+        self.assertEqual(UserRefs.objects.count(), 4)
+
+        call_command("compact_user_locations", stdout=io.StringIO())
+
+        self.assertEqual(set(UserRefs.objects.values_list("id", flat=True)), {current.id, bob_latest.id})
+        self.assertTrue(UserRefs.objects.get(id=bob_latest.id).is_current)
+        self.assertEqual(set(Location.objects.values_list("id", flat=True)),
+                         {current.location_id_id, bob_latest.location_id_id, event_location.id})
+
+
+class SendMessagesTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.organiser = User.objects.create_user(username="organiser", password="pw", first_name="Oren")
+        self.conversations = []
+        for i in range(5):
+            conversation = Conversation.objects.create(name=f"Group {i}")
+            conversation.users.add(self.organiser)
+            self.conversations.append(conversation)
+        self.outsider_conversation = Conversation.objects.create(name="Elsewhere")
+
+    def send_batch(self, messages):
+        return self.client.post("/api/sendMessages/", {"from_user_id": self.organiser.id, "messages": messages},
+                                format="json")
+
+    def test_fan_out_runs_in_constant_queries(self):
+        messages = [{"to_conversation_id": c.id, "content": "Block party on Saturday!"} for c in self.conversations]
+
+        # sender, membership, insert, conversation pointers, unread counters and sender cursors,
+        # plus SAVEPOINT and RELEASE
+        with self.assertNumQueries(8):
+            response = self.send_batch(messages)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Message.objects.count(), 5)
+        for conversation, result in zip(self.conversations, response.data["results"]):
+            conversation.refresh_from_db()
+            self.assertEqual(conversation.last_message_id, result["id"])
+
+    def test_non_scalar_sender_id(self):
+        for from_user_id in ([self.organiser.id], {"id": self.organiser.id}):
+            response = self.client.post("/api/sendMessages/", {
+                "from_user_id": from_user_id, "messages": [{"to_conversation_id": self.conversations[0].id, "content": "hi"}],
+            }, format="json")
+            self.assertEqual(response.status_code, 400)
+
+    def test_per_item_status(self):
+        response = self.send_batch([
+            {"to_conversation_id": self.conversations[0].id, "content": "hi"},
+            {"to_conversation_id": self.outsider_conversation.id, "content": "hi"},
+            {"to_conversation_id": self.conversations[1].id},
+        ])
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([r["status"] for r in response.data["results"]], ["created", "error", "error"])
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_nothing_valid(self):
+        response = self.send_batch([{"to_conversation_id": self.outsider_conversation.id, "content": "hi"}])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Message.objects.exists())
+
+
+class BatchEventMembersTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.users = [User.objects.create_user(username=f"user{i}", password="pw") for i in range(5)]
+        self.event = self.create_event("Cleanup")
+        self.event.users.add(self.users[0])
+
+    def post(self, url, **data):
+        return self.client.post(url, {"event_id": self.event.id, **data}, format="json")
+
+    def test_batch_join_ignores_existing_attendees(self):
+        user_ids = [user.id for user in self.users]
+
+        # event, user ids, existing attendees, insert, feed cleanup
+        with self.assertNumQueries(5):
+            response = self.post("/api/joinEventBatch/", user_ids=user_ids + [999])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["added"], user_ids[1:])
+        self.assertEqual(response.data["already_joined"], user_ids[:1])
+        self.assertEqual(response.data["invalid_user_ids"], ["999"])
+        self.assertEqual(self.event.users.count(), 5)
+
+    def test_non_scalar_ids(self):
+        for url in ("/api/joinEventBatch/", "/api/leaveEventBatch/", "/api/inviteToEvent/"):
+            for event_id in ([self.event.id], {"id": self.event.id}):
+                response = self.post(url, event_id=event_id, user_ids=[self.users[1].id])
+                self.assertEqual(response.status_code, 400, (url, event_id))
+        response = self.post("/api/inviteToEvent/", conversation_id=[1])
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_leave(self):
+        self.event.users.add(self.users[1])
+
+        response = self.post("/api/leaveEventBatch/", user_ids=[self.users[0].id, self.users[2].id])
+
+        self.assertEqual(response.data["removed"], [self.users[0].id])
+        self.assertEqual(list(self.event.users.all()), [self.users[1]])
+
+    def test_invite_conversation(self):
+        conversation = Conversation.objects.create(name="Street")
+        conversation.users.add(*self.users[2:])
+
+        self.post("/api/inviteToEvent/", conversation_id=conversation.id)
+
+        self.assertEqual(set(self.event.users.all()), {self.users[0], *self.users[2:]})
+
+    def test_batch_writes_invalidate_cached_listings(self):
+        self.client.get("/api/getAllEventLocations/")
+
+        self.post("/api/joinEventBatch/", user_ids=[self.users[1].id])
+
+        self.assertEqual(self.client.get("/api/getAllEventLocations/").data[0]["attendee_count"], 2)
+
+
+class DatabaseSettingsTests(TestCase):
+
+    def test_sqlite_connection_is_tuned(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("SQLite only")
+
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute("PRAGMA busy_timeout").fetchone()[0], 20000)
+
+    def test_wal_is_opt_in(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("SQLite only")
+
+        # journal_mode persists in the file, the committed db.sqlite3 must not be switched by merely opening it
+        init_command = settings.DATABASES["default"]["OPTIONS"].get("init_command", "")
+        self.assertEqual("journal_mode=WAL" in init_command, os.environ.get("CHD_DB_WAL") == "1")
+
+
+class LoadTestCommandTests(TransactionTestCase):
+
+    def test_load_test_command(self):
+        out = io.StringIO()
+        call_command("loadtest_writers", "--threads", "1", "--messages", "5", stdout=out)
+
+        self.assertIn("5 messages", out.getvalue())
+        self.assertIn("0 failed writes", out.getvalue())
+        self.assertFalse(Conversation.objects.exists())
+
+
+class QueryPlanTests(APITestCase):
+    """
+    Runs every API view and fails if SQLite plans a full scan of a table that grows with usage.
+
+    `allowed` names the tables a view may scan because it returns them whole by design.
+    """
+    LARGE_TABLES = {
+        "auth_user", "api_message", "api_conversation", "api_conversation_users",
+        "api_location", "api_userrefs", "api_event", "api_event_users",
+    }
+
+    def setUp(self):
+        super().setUp()
+        if connection.vendor != "sqlite":
+            self.skipTest("EXPLAIN QUERY PLAN is SQLite specific")
+
+        self.alice = User.objects.create_user(username="alice", password="pw", first_name="Alice")
+        self.bob = User.objects.create_user(username="bob", password="pw", first_name="Bob")
+        self.set_home(self.alice, 43.65, -79.38)
+        self.set_home(self.bob, 43.66, -79.39)
+        self.conversation = Conversation.objects.create(name="Neighbours")
+        self.conversation.users.add(self.alice, self.bob)
+        self.message = Message.objects.create(content="hello", from_user_id=self.alice, to_conversation_id=self.conversation)
+        location = Location.objects.create(latitude=43.65, longitude=-79.38, latitude_delta=0, longitude_delta=0)
+        self.event = Event.objects.create(owner_id=self.alice, name="Picnic", description="", date=timezone.now() + timedelta(days=1), location_id=location)
+        self.event.users.add(self.alice)
+
+    def full_scans(self, sql):
+        # Map aliases such as U0 or T3 back to their table names
+        aliases = {alias: table for table, alias in re.findall(r'"(\w+)"\s+(\w+)', sql)}
+        with connection.cursor() as cursor:
+            plan = cursor.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+
+        scans = set()
+        for row in plan:
+            # "SCAN TABLE x" before SQLite 3.36, "SCAN x" since
+            match = re.match(r"SCAN (?:TABLE )?(\w+)", row[3])
+            if match:
+                scans.add(aliases.get(match[1], match[1]))
+        return scans & self.LARGE_TABLES
+
+    def assertNoFullScans(self, method, url, data=None, allowed=()):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, format="json")
+        self.assertLess(response.status_code, 400, response.content)
+
+        for query in queries:
+            if query["sql"].lstrip().upper().startswith("SELECT"):
+                scans = self.full_scans(query["sql"]) - set(allowed)
+                self.assertFalse(scans, f"{url} scans {scans}:\n{query['sql']}")
+
+    def test_user_views(self):
+        self.assertNoFullScans("get", f"/api/listUsers/{self.alice.id}/", allowed={"auth_user"})
+        self.assertNoFullScans("get", f"/api/lookupUsers/{self.alice.id}/", {"q": "bo"})
+        self.assertNoFullScans("get", f"/api/lookupUsers/{self.alice.id}/", {"q": "bob b"})
+        self.assertNoFullScans("post", "/api/login/", {"username": "alice", "password": "pw"})
+        self.assertNoFullScans("get", f"/api/getUserInfo/{self.alice.id}/")
+        self.assertNoFullScans("get", f"/api/search/{self.alice.id}/", {"q": "ali", "type": "users"})
+        self.assertNoFullScans("get", f"/api/getAllUserLocations/{self.alice.id}/", allowed={"auth_user"})
+        self.assertNoFullScans("post", "/api/setUserLocation/", {
+            "user_id": self.alice.id, "city": "Toronto", "country": "Canada", "region": "Ontario",
+            "latitude": 43.7, "longitude": -79.4, "latitude_delta": 0.1, "longitude_delta": 0.1,
+        })
+
+    def test_conversation_views(self):
+        conversation_url = f"/api/getConversationMessages/{self.conversation.id}/"
+        self.assertNoFullScans("get", conversation_url)
+        self.assertNoFullScans("get", conversation_url, {"after_id": self.message.id})
+        self.assertNoFullScans("get", conversation_url, {"before_id": self.message.id, "limit": 20})
+        self.assertNoFullScans("get", f"/api/loadConversations/{self.alice.id}/")
+        self.assertNoFullScans("get", f"/api/getReadReceipts/{self.conversation.id}/")
+        self.assertNoFullScans("post", "/api/markConversationRead/", {"user_id": self.bob.id, "conversation_id": self.conversation.id})
+        self.assertNoFullScans("get", f"/api/search/{self.alice.id}/", {"q": "hel"})
+        self.assertNoFullScans("get", f"/api/async/getConversationMessages/{self.conversation.id}/", {"limit": 20})
+        self.assertNoFullScans("get", f"/api/async/loadConversations/{self.alice.id}/")
+        self.assertNoFullScans("get", f"/api/async/pollMessages/{self.conversation.id}/", {"after_id": self.message.id, "timeout": 0})
+        self.assertNoFullScans("post", "/api/async/sendMessage/", {
+            "content": "hi", "from_user_id": self.alice.id, "to_conversation_id": self.conversation.id,
+        })
+        self.assertNoFullScans("post", "/api/sendMessage/", {
+            "content": "hi", "from_user_id": self.alice.id, "to_conversation_id": self.conversation.id,
+        })
+        self.assertNoFullScans("post", "/api/sendMessages/", {
+            "from_user_id": self.alice.id, "messages": [{"to_conversation_id": self.conversation.id, "content": "hi"}],
+        })
+        self.assertNoFullScans("post", "/api/createConversation/", {
+            "content": "hi", "from_user_id": self.alice.id, "to_user_ids": [self.bob.id], "conversation_name": "Us",
+        })
+
+    def test_event_views(self):
+        viewport = {"min_lat": 43.5, "max_lat": 43.8, "min_lng": -79.5, "max_lng": -79.2}
+        self.assertNoFullScans("get", "/api/getAllEventLocations/", viewport)
+        self.assertNoFullScans("get", "/api/getAllEventLocations/")
+        self.assertNoFullScans("get", f"/api/getAvailableEvents/{self.bob.id}/")
+        self.assertNoFullScans("get", f"/api/getAvailableEvents/{self.bob.id}/", {"after_id": self.event.id})
+        self.assertNoFullScans("get", f"/api/getNearbyEvents/{self.bob.id}/")
+        self.assertNoFullScans("get", f"/api/search/{self.bob.id}/", {"q": "picnic", "type": "events"})
+        self.assertNoFullScans("get", f"/api/getNearbyUsers/{self.bob.id}/")
+        self.assertNoFullScans("get", "/api/getMapClusters/", {"zoom": 10, "layer": "events", **viewport})
+        self.assertNoFullScans("get", "/api/getMapClusters/", {"zoom": 10, "layer": "users", **viewport})
+        self.assertNoFullScans("post", "/api/createEvent/", {
+            "owner_id": self.alice.id, "date": "2030-01-01T12:00:00Z", "event_name": "Cleanup", "description": "Bring gloves",
+            "city": "Toronto", "region": "Ontario", "country": "Canada", "latitude": 43.65, "longitude": -79.38,
+        })
+        self.assertNoFullScans("post", "/api/joinEvent/", {"user_id": self.bob.id, "event_id": self.event.id})
+        self.assertNoFullScans("post", "/api/joinEventBatch/", {"event_id": self.event.id, "user_ids": [self.bob.id]})
+        self.assertNoFullScans("post", "/api/leaveEventBatch/", {"event_id": self.event.id, "user_ids": [self.bob.id]})
+        self.assertNoFullScans("post", "/api/inviteToEvent/", {"event_id": self.event.id, "conversation_id": self.conversation.id})
+
+
+class AsyncChatViewTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.async_client = AsyncClient()
+        self.alice = User.objects.create_user(username="alice", password="pw", first_name="Alice")
+        self.bob = User.objects.create_user(username="bob", password="pw", first_name="Bob")
+        self.conversation = Conversation.objects.create(name="Neighbours")
+        self.conversation.users.add(self.alice, self.bob)
+        for i in range(5):
+            post_message(f"message {i}", self.alice, self.conversation)
+
+    async def test_send_message(self):
+        response = await self.async_client.post("/api/async/sendMessage/", {
+            "content": "hello", "from_user_id": self.bob.id, "to_conversation_id": self.conversation.id,
+        }, content_type="application/json")
+
+        self.assertEqual(response.status_code, 201)
+        message = await Message.objects.alatest("id")
+        self.assertEqual((message.content, message.from_user_id_id), ("hello", self.bob.id))
+        await self.conversation.arefresh_from_db()
+        self.assertEqual(self.conversation.last_message_id, message.id)
+
+    async def test_send_message_validates_ids(self):
+        for body in ({"content": "hi"}, {"content": "hi", "from_user_id": 999, "to_conversation_id": self.conversation.id},
+                     {"content": "hi", "from_user_id": "abc", "to_conversation_id": self.conversation.id}):
+            response = await self.async_client.post("/api/async/sendMessage/", body, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("error", response.json())
+
+    async def test_send_message_rejects_non_object_bodies(self):
+        for body in ("[1, 2]", '"hi"', "42", "null", "{", json.dumps({
+            "content": "hi", "from_user_id": [self.bob.id], "to_conversation_id": self.conversation.id,
+        })):
+            response = await self.async_client.post("/api/async/sendMessage/", body, content_type="application/json")
+            self.assertEqual(response.status_code, 400, body)
+            self.assertIn("error", response.json())
+
+    async def test_messages_match_sync_view(self):
+        for params in ({}, {"after_id": 0}, {"limit": 2}):
+            with self.subTest(params=params):
+                url = f"/getConversationMessages/{self.conversation.id}/"
+                async_response = await self.async_client.get(f"/api/async{url}", params)
+                sync_response = await sync_to_async(self.client.get)(f"/api{url}", params)
+                self.assertEqual(async_response.status_code, 200)
+                self.assertEqual(async_response.json(), sync_response.json())
+
+    async def test_messages_reject_bad_cursor(self):
+        response = await self.async_client.get(f"/api/async/getConversationMessages/{self.conversation.id}/", {"after_id": "x"})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_inbox_matches_sync_view(self):
+        async_response = await self.async_client.get(f"/api/async/loadConversations/{self.bob.id}/")
+        sync_response = await sync_to_async(self.client.get)(f"/api/loadConversations/{self.bob.id}/")
+
+        self.assertEqual(async_response.status_code, 200)
+        self.assertEqual(async_response.json(), sync_response.json())
+        self.assertEqual(async_response.json()[0]["preview"], "message 4")
+
+
+    async def test_conditional_get(self):
+        for url in (f"/api/async/getConversationMessages/{self.conversation.id}/", f"/api/async/loadConversations/{self.bob.id}/"):
+            with self.subTest(url=url):
+                response = await self.async_client.get(url)
+                self.assertIn("ETag", response)
+
+                unchanged = await self.async_client.get(url, headers={"If-None-Match": response["ETag"]})
+                self.assertEqual(unchanged.status_code, 304)
+                self.assertEqual(unchanged["ETag"], response["ETag"])
+
+                await sync_to_async(post_message)("new", self.alice, self.conversation)
+                changed = await self.async_client.get(url, headers={"If-None-Match": response["ETag"]})
+                self.assertEqual(changed.status_code, 200)
+                self.assertNotEqual(changed["ETag"], response["ETag"])
+
+
+class LongPollTests(TransactionTestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice", password="pw", first_name="Alice")
+        self.conversation = Conversation.objects.create(name="Neighbours")
+        self.conversation.users.add(self.alice)
+        self.url = f"/api/async/pollMessages/{self.conversation.id}/"
+
+    async def test_returns_pending_messages_immediately(self):
+        first = await sync_to_async(post_message)("hello", self.alice, self.conversation)
+        await sync_to_async(post_message)("again", self.alice, self.conversation)
+
+        response = await asyncio.wait_for(AsyncClient().get(self.url, {"after_id": first.id}), timeout=1)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m["content"] for m in response.json()], ["again"])
+
+    async def test_wakes_up_on_new_message(self):
+        poll = asyncio.ensure_future(AsyncClient().get(self.url, {"after_id": 0, "timeout": 10}))
+        await asyncio.sleep(0.2)
+        self.assertFalse(poll.done())
+
+        await sync_to_async(APIClient().post)("/api/sendMessage/", {
+            "content": "hello",
+            "from_user_id": self.alice.id,
+            "to_conversation_id": self.conversation.id,
+        })
+
+        response = await asyncio.wait_for(poll, timeout=2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]["content"], "hello")
+        self.assertEqual(response.json()[0]["sender_first_name"], "Alice")
+
+    async def test_times_out_with_empty_list(self):
+        response = await asyncio.wait_for(AsyncClient().get(self.url, {"after_id": 0, "timeout": 1}), timeout=3)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+
+    async def test_rejects_bad_requests(self):
+        client = AsyncClient()
+        self.assertEqual((await client.get(self.url)).status_code, 400)
+        self.assertEqual((await client.get(self.url, {"after_id": 0, "timeout": "x"})).status_code, 400)
+        self.assertEqual((await client.get("/api/async/pollMessages/999/", {"after_id": 0})).status_code, 400)
+
+
+class EventFeedTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.local = User.objects.create_user(username="local", password="pw", first_name="Lou")
+        self.remote = User.objects.create_user(username="remote", password="pw", first_name="Remy")
+        self.set_home(self.local, 43.65, -79.38)  # Toronto
+        self.set_home(self.remote, 45.50, -73.57)  # Montreal
+
+    def create_event(self, name, latitude=43.66, longitude=-79.39, days=1):
+        # Through the API, which fills the feeds of the users living nearby
+        response = self.client.post("/api/createEvent/", {
+            "owner_id": self.owner.id, "date": (timezone.now() + timedelta(days=days)).isoformat(),
+            "event_name": name, "description": "-", "city": "Toronto", "region": "Ontario", "country": "Canada",
+            "latitude": latitude, "longitude": longitude,
+        })
+        self.assertEqual(response.status_code, 201)
+        return Event.objects.get(name=name)
+
+    def feed(self, user, **params):
+        response = self.client.get(f"/api/getAvailableEvents/{user.id}/", params)
+        self.assertEqual(response.status_code, 200)
+        return [event["name"] for event in response.data]
+
+    def test_new_events_reach_nearby_users_only(self):
+        self.create_event("Picnic")
+
+        self.assertEqual(self.feed(self.local), ["Picnic"])
+        self.assertEqual(self.feed(self.remote), [])
+
+    def test_past_events_are_not_listed(self):
+        self.create_event("Yesterday", days=-1)
+        self.create_event("Tomorrow")
+
+        self.assertEqual(self.feed(self.local), ["Tomorrow"])
+        self.assertEqual(EventFeedEntry.objects.count(), 1)
+
+    def test_join_and_leave(self):
+        event = self.create_event("Picnic")
+
+        self.client.post("/api/joinEvent/", {"user_id": self.local.id, "event_id": event.id})
+        self.assertEqual(self.feed(self.local), [])
+
+        self.client.post("/api/leaveEventBatch/", {"event_id": event.id, "user_ids": [self.local.id]}, format="json")
+        self.assertEqual(self.feed(self.local), ["Picnic"])
+
+        self.client.post("/api/joinEventBatch/", {"event_id": event.id, "user_ids": [self.local.id]}, format="json")
+        self.assertEqual(self.feed(self.local), [])
+
+    def test_attendee_changes_outside_the_api(self):
+        # e.g. from the admin or a shell
+        event = self.create_event("Picnic")
+
+        def feed_after(change):
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            return self.feed(self.local)
+
+        self.assertEqual(feed_after(lambda: event.users.add(self.local)), [])
+        self.assertEqual(feed_after(lambda: event.users.remove(self.local)), ["Picnic"])
+        self.assertEqual(feed_after(lambda: self.local.event.add(event)), [])
+        self.assertEqual(feed_after(lambda: self.local.event.clear()), ["Picnic"])
+        self.assertEqual(feed_after(lambda: event.users.add(self.local)), [])
+        self.assertEqual(feed_after(lambda: event.users.clear()), ["Picnic"])
+
+    def test_moving_rebuilds_the_feed(self):
+        self.create_event("Picnic")
+
+        self.set_home(self.remote, 43.70, -79.40)
+        self.assertEqual(self.feed(self.remote), ["Picnic"])
+
+        self.set_home(self.local, 45.50, -73.57)
+        self.assertEqual(self.feed(self.local), [])
+
+    def test_rescheduling_keeps_the_feed_in_order(self):
+        first, second = self.create_event("First", days=1), self.create_event("Second", days=2)
+
+        second.date = first.date - timedelta(hours=1)
+        second.save()
+
+        self.assertEqual(self.feed(self.local), ["Second", "First"])
+
+    def test_paging(self):
+        for day in range(1, 6):
+            self.create_event(f"Day {day}", days=day)
+
+        page = self.client.get(f"/api/getAvailableEvents/{self.local.id}/", {"limit": 2}).data
+        self.assertEqual([event["name"] for event in page], ["Day 1", "Day 2"])
+        self.assertEqual(self.feed(self.local, limit=2, after_id=page[-1]["event_id"]), ["Day 3", "Day 4"])
+        self.assertEqual(self.client.get(f"/api/getAvailableEvents/{self.local.id}/", {"limit": "x"}).status_code, 400)
+
+    def test_users_without_home_see_every_upcoming_event(self):
+        homeless = User.objects.create_user(username="homeless", password="pw")
+        self.create_event("Picnic")
+        self.create_event("Far away", latitude=51.5, longitude=-0.12)
+
+        self.assertEqual(self.feed(homeless), ["Picnic", "Far away"])
+
+    def test_refresh_command(self):
+        self.create_event("Picnic")
+        EventFeedEntry.objects.update(date=timezone.now() - timedelta(hours=1))
+        out = io.StringIO()
+
+        call_command("refresh_event_feeds", stdout=out)
+        self.assertFalse(EventFeedEntry.objects.exists())
+
+        call_command("refresh_event_feeds", "--rebuild", stdout=out)
+        self.assertEqual(list(EventFeedEntry.objects.values_list("user_id", flat=True)), [self.local.id])
+        self.assertIn("rebuilt 2 feeds", out.getvalue())
+
+
+class EventWindowTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.guest = User.objects.create_user(username="guest", password="pw", first_name="Gus")
+        self.events = {days: self.create_event(f"In {days} days", days=days, location=self.create_location(city="Toronto"))
+                       for days in (-3, 2, 30, 400)}
+
+    def names(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return [event.get("event_name", event.get("name")) for event in response.data]
+
+    def test_upcoming_events_within_horizon(self):
+        self.assertEqual(self.names("/api/getAllEventLocations/"), ["In 2 days", "In 30 days"])
+        self.assertEqual(self.names(f"/api/getAvailableEvents/{self.guest.id}/"), ["In 2 days", "In 30 days"])
+
+    def test_shorter_horizon(self):
+        self.assertEqual(self.names("/api/getAllEventLocations/", horizon_days=7), ["In 2 days"])
+        self.assertEqual(self.names(f"/api/getAvailableEvents/{self.guest.id}/", horizon_days=7), ["In 2 days"])
+
+        # The configured horizon is a hard limit
+        self.assertEqual(self.names("/api/getAllEventLocations/", horizon_days=10000), ["In 2 days", "In 30 days"])
+        self.assertEqual(self.client.get("/api/getAllEventLocations/", {"horizon_days": "soon"}).status_code, 400)
+
+    def test_cache_keys_are_memcached_safe(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", CacheKeyWarning)
+            self.names("/api/getAllEventLocations/")
+            self.names(f"/api/getAvailableEvents/{self.guest.id}/")
+
+    def test_archive_past_events(self):
+        past = self.events[-3]
+        past.users.add(self.guest)
+        location_id = past.location_id_id
+        out = io.StringIO()
+
+        call_command("archive_past_events", "--dry-run", stdout=out)
+        self.assertIn("Would archive 1 events", out.getvalue())
+        self.assertTrue(Event.objects.filter(id=past.id).exists())
+
+        call_command("archive_past_events", "--batch-size", "1", stdout=out)
+        self.assertIn("Archived 1 events with 1 attendees", out.getvalue())
+
+        archived = ArchivedEvent.objects.get(id=past.id)
+        self.assertEqual((archived.name, archived.city, archived.latitude), ("In -3 days", "Toronto", 43.65))
+        self.assertEqual(list(archived.users.all()), [self.guest])
+        self.assertFalse(Event.objects.filter(id=past.id).exists())
+        self.assertFalse(Location.objects.filter(id=location_id).exists())
+        self.assertEqual(Event.objects.count(), 3)
+
+    def test_archive_keeps_shared_locations(self):
+        past = self.events[-3]
+        UserRefs.objects.create(user_id=self.guest, location_id=past.location_id, is_current=True)
+
+        call_command("archive_past_events", stdout=io.StringIO())
+
+        self.assertTrue(Location.objects.filter(id=past.location_id_id).exists())
+        self.assertEqual(self.client.get(f"/api/getUserInfo/{self.guest.id}/").data["city"], "Toronto")
+
+
+class SearchTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user(username="alice", password="pw", first_name="Alice", last_name="Smith")
+        self.bob = User.objects.create_user(username="bob", password="pw", first_name="Bob", last_name="Alison")
+        self.carol = User.objects.create_user(username="carol", password="pw", first_name="Carol")
+        self.ours = Conversation.objects.create(name="Ours")
+        self.ours.users.add(self.alice, self.bob)
+        self.theirs = Conversation.objects.create(name="Theirs")
+        self.theirs.users.add(self.bob, self.carol)
+
+    def search(self, user, q, **params):
+        response = self.client.get(f"/api/search/{user.id}/", {"q": q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_messages_are_limited_to_members(self):
+        post_messages(self.bob, [(self.ours.id, "Garden cleanup on Saturday"), (self.theirs.id, "Garden party plans")])
+
+        hits = self.search(self.alice, "gard")
+        self.assertEqual([hit["content"] for hit in hits], ["Garden cleanup on Saturday"])
+        self.assertEqual(hits[0]["snippet"], "[Garden] cleanup on Saturday")
+        self.assertEqual(hits[0]["sender_first_name"], "Bob")
+        self.assertEqual(len(self.search(self.bob, "garden")), 2)
+        self.assertEqual(self.search(self.carol, "cleanup"), [])
+
+    def test_ranking_and_paging(self):
+        post_messages(self.alice, [(self.ours.id, "bring the tools for the cleanup crew"), (self.ours.id, "tools"),
+                                   (self.ours.id, "lunch"), (self.ours.id, "tools for lunch")])
+
+        # bm25 favours the shorter of two messages with the same matches
+        self.assertEqual(self.search(self.alice, "tools", limit=1)[0]["content"], "tools")
+        self.assertEqual(len(self.search(self.alice, "tools", limit=2, offset=2)), 1)
+        self.assertEqual([hit["content"] for hit in self.search(self.alice, "tools lunch")], ["tools for lunch"])
+
+    def test_index_follows_edits_and_deletes(self):
+        message = post_message("old words", self.alice, self.ours)
+
+        Message.objects.filter(id=message.id).update(content="new words")
+        self.assertEqual(self.search(self.alice, "old"), [])
+        self.assertEqual(len(self.search(self.alice, "new")), 1)
+
+        message.delete()
+        self.assertEqual(self.search(self.alice, "words"), [])
+
+    def test_events_rank_names_first(self):
+        location = Location.objects.create(city="Toronto", latitude=43.65, longitude=-79.38, latitude_delta=0, longitude_delta=0)
+        Event.objects.create(owner_id=self.alice, name="Cleanup", description="Bring a garden rake", location_id=location)
+        Event.objects.create(owner_id=self.alice, name="Garden party", description="Food", location_id=location)
+
+        hits = self.search(self.alice, "garden", type="events")
+        self.assertEqual([hit["name"] for hit in hits], ["Garden party", "Cleanup"])
+        self.assertEqual(hits[0]["city"], "Toronto")
+
+    def test_users(self):
+        hits = self.search(self.carol, "ali", type="users")
+        self.assertEqual({hit["id"] for hit in hits}, {self.alice.id, self.bob.id})
+
+        self.alice.first_name = "Alex"
+        self.alice.save()
+        self.assertEqual([hit["id"] for hit in self.search(self.carol, "alex", type="users")], [self.alice.id])
+
+    def test_query_syntax_is_not_interpreted(self):
+        post_message('say "hello" OR NOT', self.alice, self.ours)
+
+        self.assertEqual(len(self.search(self.alice, 'hello" OR NOT*')), 1)
+        self.assertEqual(self.client.get(f"/api/search/{self.alice.id}/", {"q": '"*'}).status_code, 400)
+        self.assertEqual(self.client.get(f"/api/search/{self.alice.id}/", {"q": "a", "type": "x"}).status_code, 400)
+        self.assertEqual(self.client.get(f"/api/search/{self.alice.id}/", {"q": "a", "limit": "-1"}).status_code, 400)
+
+    def test_like_fallback_without_fts(self):
+        post_messages(self.bob, [(self.ours.id, "Garden cleanup"), (self.theirs.id, "Garden party")])
+
+        with mock.patch.object(connection, "vendor", "postgresql"):
+            messages = self.search(self.alice, "gard")
+            users = self.search(self.carol, "ali", type="users")
+
+        self.assertEqual([hit["content"] for hit in messages], ["Garden cleanup"])
+        self.assertEqual({hit["id"] for hit in users}, {self.alice.id, self.bob.id})
+
+
+class SearchIndexRepairTests(TransactionTestCase):
+
+    def setUp(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("FTS5 is SQLite specific")
+        self.alice = User.objects.create_user(username="alice", password="pw", first_name="Alice")
+        self.location = Location.objects.create(latitude=43.65, longitude=-79.38, latitude_delta=0, longitude_delta=0)
+
+    def rebuild_event_table(self, max_length):
+        # Changing max_length makes SQLite's schema editor copy the table, dropping its triggers
+        old_field = Event._meta.get_field("name")
+        new_field = copy.deepcopy(old_field)
+        new_field.max_length = max_length
+        with connection.schema_editor() as editor:
+            editor.alter_field(Event, old_field, new_field)
+
+    def search_events(self, q):
+        response = APIClient().get(f"/api/search/{self.alice.id}/", {"q": q, "type": "events"})
+        return [hit["name"] for hit in response.data]
+
+    def test_triggers_are_restored_after_a_table_rebuild(self):
+        self.rebuild_event_table(201)
+        self.addCleanup(lambda: (self.rebuild_event_table(200), search.ensure_indexes()))
+        Event.objects.create(owner_id=self.alice, name="Missed picnic", description="", location_id=self.location)
+
+        call_command("migrate", verbosity=0)
+
+        Event.objects.create(owner_id=self.alice, name="Garden picnic", description="", location_id=self.location)
+        self.assertEqual(sorted(self.search_events("picnic")), ["Garden picnic", "Missed picnic"])
+        self.assertEqual(search.ensure_indexes(), [])
+
+
+class LookupUsersTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.me = User.objects.create_user(username="me", password="pw", first_name="Sam")
+        self.set_home(self.me, 43.65, -79.38)
+
+    def user(self, username, first_name, last_name="", home=None):
+        user = User.objects.create_user(username=username, password="pw", first_name=first_name, last_name=last_name)
+        if home:
+            self.set_home(user, *home)
+        return user
+
+    def lookup(self, q, **params):
+        response = self.client.get(f"/api/lookupUsers/{self.me.id}/", {"q": q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [user["first_name"] for user in response.data]
+
+    def test_prefix_of_any_name_word(self):
+        self.user("zoe", "Zoë", "Martin")
+        self.user("mark", "Mark", "Zimmer")
+        self.user("ann", "Ann")
+
+        self.assertEqual(self.lookup("zo"), ["Zoë"])
+        self.assertEqual(self.lookup("Z"), ["Mark", "Zoë"])
+        self.assertEqual(self.lookup("mar"), ["Mark", "Zoë"])
+        self.assertEqual(self.lookup("zoe mar"), ["Zoë"])
+        self.assertEqual(self.lookup("sam"), [])
+        self.assertEqual(self.lookup(""), [])
+
+    def test_exact_words_and_neighbours_rank_first(self):
+        self.user("far", "Alex", home=(45.50, -73.57))
+        self.user("near", "Alexandra", home=(43.66, -79.39))
+        self.user("homeless", "Alexis")
+
+        self.assertEqual(self.lookup("alex"), ["Alex", "Alexandra", "Alexis"])
+        self.assertEqual(self.lookup("alexa"), ["Alexandra"])
+
+        response = self.client.get(f"/api/lookupUsers/{self.me.id}/", {"q": "alexandra"})
+        self.assertLess(response.data[0]["distance_km"], 2)
+
+    def test_hard_limit(self):
+        for i in range(30):
+            self.user(f"user{i}", f"Pat{i}")
+
+        self.assertEqual(len(self.lookup("pat")), 10)
+        self.assertEqual(len(self.lookup("pat", limit=100)), 25)
+        self.assertEqual(self.client.get(f"/api/lookupUsers/{self.me.id}/", {"q": "p", "limit": "x"}).status_code, 400)
+
+    def test_tokens_follow_renames(self):
+        user = self.user("kim", "Kim")
+        user.first_name = "Robin"
+        user.save(update_fields=["first_name"])
+
+        self.assertEqual(self.lookup("kim"), [])
+        self.assertEqual(self.lookup("rob"), ["Robin"])
+
+    def test_constant_queries(self):
+        for i in range(30):
+            self.user(f"user{i}", f"Pat{i}", home=(43.6, -79.4))
+
+        # own home, candidates with their names and homes
+        with self.assertNumQueries(2):
+            self.lookup("pat")
+
+    def test_more_matches_than_candidates(self):
+        crowd = User.objects.bulk_create(
+            User(username=f"crowd{i}", first_name="Alexander", last_name=f"Crowd{i}")
+            for i in range(typeahead.MAX_CANDIDATES + 50)
+        )
+        UserNameToken.objects.bulk_create(UserNameToken(user_id=user, token="alexander") for user in crowd)
+        self.user("zed", "Alexander", "Zed")
+        self.user("neighbour", "Alexander", "Neighbour", home=(43.66, -79.39))
+
+        # Every word is matched before the cap, the closest users make it in first
+        self.assertEqual(self.lookup("alexander zed"), ["Alexander"])
+        response = self.client.get(f"/api/lookupUsers/{self.me.id}/", {"q": "alexander"})
+        self.assertEqual(response.data[0]["last_name"], "Neighbour")
+
+
+class ReadCursorTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user(username="alice", password="pw", first_name="Alice")
+        self.bob = User.objects.create_user(username="bob", password="pw", first_name="Bob")
+        self.conversation = Conversation.objects.create(name="Neighbours")
+        self.conversation.users.add(self.alice, self.bob)
+
+    def inbox(self, user, **headers):
+        return self.client.get(f"/api/loadConversations/{user.id}/", **headers)
+
+    def mark_read(self, user, **data):
+        return self.client.post("/api/markConversationRead/", {"user_id": user.id, "conversation_id": self.conversation.id} | data)
+
+    def test_unread_counts(self):
+        post_messages(self.alice, [(self.conversation.id, "one"), (self.conversation.id, "two")])
+        post_message("three", self.alice, self.conversation)
+
+        self.assertEqual(self.inbox(self.bob).data[0]["unread_count"], 3)
+        self.assertEqual(self.inbox(self.alice).data[0]["unread_count"], 0)
+
+        # Replying reads the conversation
+        reply = post_message("hi", self.bob, self.conversation)
+        self.assertEqual(self.inbox(self.bob).data[0]["unread_count"], 0)
+        self.assertEqual(self.inbox(self.bob).data[0]["last_read_message_id"], reply.id)
+        self.assertEqual(self.inbox(self.alice).data[0]["unread_count"], 1)
+
+    def test_mark_read(self):
+        first = post_message("one", self.alice, self.conversation)
+        post_message("two", self.alice, self.conversation)
+        last = post_message("three", self.alice, self.conversation)
+
+        response = self.mark_read(self.bob, message_id=first.id)
+        self.assertEqual(response.data, {"unread_count": 2, "last_read_message_id": first.id})
+
+        response = self.mark_read(self.bob)
+        self.assertEqual(response.data, {"unread_count": 0, "last_read_message_id": last.id})
+
+        # Cursors never move backwards
+        self.assertEqual(self.mark_read(self.bob, message_id=first.id).data["last_read_message_id"], last.id)
+
+    def test_mark_read_validates(self):
+        other = Conversation.objects.create(name="Other")
+        foreign = post_message("elsewhere", self.alice, other)
+
+        self.assertEqual(self.mark_read(self.bob, message_id=foreign.id).status_code, 400)
+        self.assertEqual(self.client.post("/api/markConversationRead/", {"user_id": self.bob.id, "conversation_id": other.id}).status_code, 400)
+        self.assertEqual(self.client.post("/api/markConversationRead/", {"user_id": self.bob.id}).status_code, 400)
+
+    def test_mark_read_rejects_non_scalar_ids(self):
+        message = post_message("one", self.alice, self.conversation)
+        valid = {"user_id": self.bob.id, "conversation_id": self.conversation.id, "message_id": message.id}
+
+        for field in valid:
+            for value in ([valid[field]], {"id": valid[field]}):
+                response = self.client.post("/api/markConversationRead/", {**valid, field: value}, format="json")
+                self.assertEqual(response.status_code, 400, (field, value))
+
+    def test_inbox_stays_constant_and_revalidates_after_reads(self):
+        for i in range(5):
+            conversation = Conversation.objects.create(name=f"Street {i}")
+            conversation.users.add(self.alice, self.bob)
+            post_message("hello", self.alice, conversation)
+
+        # Fingerprint + listing
+        with self.assertNumQueries(2):
+            response = self.inbox(self.bob)
+        self.assertEqual([convo["unread_count"] for convo in response.data], [1, 1, 1, 1, 1, 0])
+
+        self.assertEqual(self.inbox(self.bob, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+        self.mark_read(self.bob, conversation_id=conversation.id)
+        after = self.inbox(self.bob, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(after.status_code, 200)
+        self.assertEqual(after.data[0]["unread_count"], 0)
+
+    def test_membership_changes(self):
+        carol = User.objects.create_user(username="carol", password="pw")
+        post_message("before carol", self.alice, self.conversation)
+
+        self.conversation.users.add(carol)
+        post_message("after carol", self.alice, self.conversation)
+        self.assertEqual(ReadCursor.objects.get(user_id=carol).unread_count, 1)
+
+        self.conversation.users.remove(carol)
+        self.assertFalse(ReadCursor.objects.filter(user_id=carol).exists())
+        self.conversation.users.clear()
+        self.assertFalse(ReadCursor.objects.exists())
+
+    def test_read_receipts(self):
+        message = post_message("hello", self.alice, self.conversation)
+        self.mark_read(self.bob)
+
+        receipts = self.client.get(f"/api/getReadReceipts/{self.conversation.id}/").data
+        self.assertEqual([(r["first_name"], r["last_read_message_id"]) for r in receipts],
+                         [("Alice", message.id), ("Bob", message.id)])
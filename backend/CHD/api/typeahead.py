@@ -0,0 +1,110 @@
+import math
+import re
+import unicodedata
+
+from django.db.models import Exists, ExpressionWrapper, F, FilteredRelation, FloatField, OuterRef, Q
+from django.db.models.functions import Abs, Least
+
+from . import geo
+from .models import UserNameToken, UserRefs
+
+
+# Typeahead over user names. Every word of a name is stored normalized in UserNameToken,
+# so a prefix is an index range scan whatever the number of users, and only a bounded
+# number of candidates, the closest to the searching user, is ever ranked.
+
+MAX_CANDIDATES = 200
+NEARBY_KM = 50
+
+
+def normalize(text):
+    # Case and accent insensitive: "Zoë" and "zoe" are the same token
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def name_tokens(first_name, last_name):
+    return set(re.findall(r"\w+", normalize(f"{first_name} {last_name}")))
+
+
+def index_user(user):
+    """Bring the tokens of `user` in line with their current name."""
+    tokens = name_tokens(user.first_name, user.last_name)
+    UserNameToken.objects.filter(user_id=user).exclude(token__in=tokens).delete()
+    UserNameToken.objects.bulk_create(
+        [UserNameToken(user_id=user, token=token) for token in tokens],
+        ignore_conflicts=True,
+    )
+
+
+def prefix_range(prefix):
+    # Every string starting with `prefix` sorts in [prefix, successor), which an index can seek
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _starts_with(word):
+    low, high = prefix_range(word)
+    return Q(token__gte=low, token__lt=high)
+
+
+def _squared_offset(latitude, longitude):
+    # Equirectangular approximation of the distance to (latitude, longitude), good enough to
+    # pick the closest candidates, which are then ranked by their exact haversine distance
+    longitude_offset = Abs(F("home__location_id__longitude") - longitude)
+    longitude_offset = Least(longitude_offset, 360 - longitude_offset) * math.cos(math.radians(latitude))
+    latitude_offset = F("home__location_id__latitude") - latitude
+    return ExpressionWrapper(latitude_offset * latitude_offset + longitude_offset * longitude_offset,
+                             output_field=FloatField())
+
+
+def lookup(user_id, query, limit):
+    """
+    Users other than `user_id` with a name word starting with each word of `query`.
+
+    Exact word matches rank first, then users living within NEARBY_KM of `user_id`'s home,
+    then by name. Returns at most `limit` dicts with id, first_name, last_name and
+    distance_km (None when either home is unknown).
+    """
+    words = sorted(set(re.findall(r"\w+", normalize(query))), key=len, reverse=True)
+    if not words:
+        return []
+
+    # The longest word is the most selective one, it drives the index scan, and every other
+    # word has to match too before candidates are capped
+    candidates = UserNameToken.objects.filter(_starts_with(words[0])).exclude(user_id=user_id)
+    for word in words[1:]:
+        candidates = candidates.filter(Exists(UserNameToken.objects.filter(_starts_with(word), user_id=OuterRef("user_id"))))
+    candidates = candidates.annotate(
+        home=FilteredRelation("user_id__userrefs", condition=Q(user_id__userrefs__is_current=True)),
+    )
+
+    home = UserRefs.objects.current().filter(user_id=user_id).values_list(
+        "location_id__latitude", "location_id__longitude"
+    ).first()
+    if home is not None:
+        # The closest users make the cut, users without a home come last
+        candidates = candidates.order_by(_squared_offset(*home).asc(nulls_last=True), "token", "user_id")
+    else:
+        candidates = candidates.order_by("token", "user_id")
+
+    rows = candidates.values_list(
+        "user_id", "user_id__first_name", "user_id__last_name", "home__location_id__latitude", "home__location_id__longitude"
+    )[:MAX_CANDIDATES]
+
+    ranked = {}
+    for candidate, first_name, last_name, latitude, longitude in rows:
+        # A user appears once per matching name word
+        if candidate in ranked:
+            continue
+
+        distance = None
+        if home is not None and latitude is not None:
+            distance = round(geo.haversine_km(*home, latitude, longitude), 3)
+
+        exact = len(name_tokens(first_name, last_name) & set(words))
+        nearby = distance is not None and distance <= NEARBY_KM
+        key = (-exact, not nearby, distance if distance is not None else math.inf,
+               normalize(first_name), normalize(last_name), candidate)
+        ranked[candidate] = (key, {"id": candidate, "first_name": first_name, "last_name": last_name, "distance_km": distance})
+
+    return [user for _, user in sorted(ranked.values(), key=lambda item: item[0])[:limit]]
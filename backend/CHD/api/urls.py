@@ -4,16 +4,31 @@ from django.urls import path
 
 urlpatterns = [
     path('listUsers/<str:id>/', views.ListUsersView.as_view(), name=''),
+    path('lookupUsers/<str:id>/', views.LookupUsersView.as_view(), name=''),
     path('sendMessage/', views.SendMessageView.as_view(), name=''),
+    path('sendMessages/', views.SendMessagesView.as_view(), name=''),
     path('getConversationMessages/<str:id>/', views.GetConversationMessagesView.as_view(), name=''),
     path('createConversation/', views.CreateConversationView.as_view(), name=''),
     path('loadConversations/<str:id>/', views.LoadConversationsView.as_view(), name=''),
+    path('markConversationRead/', views.MarkConversationReadView.as_view(), name=''),
+    path('getReadReceipts/<str:id>/', views.GetReadReceiptsView.as_view(), name=''),
     path('login/', views.LoginView.as_view(), name=''),
     path('setUserLocation/', views.SetUserLocationView.as_view(), name=''),
     path('createEvent/', views.CreateEventView.as_view(), name=''),
     path('getUserInfo/<str:id>/', views.GetUserInfoView.as_view(), name=''),
     path('getAvailableEvents/<str:id>/', views.GetAvailableEventsView.as_view(), name=''),
     path('joinEvent/', views.JoinEventView.as_view(), name='get_user_info'),
+    path('joinEventBatch/', views.BatchJoinEventView.as_view(), name=''),
+    path('leaveEventBatch/', views.BatchLeaveEventView.as_view(), name=''),
+    path('inviteToEvent/', views.InviteToEventView.as_view(), name=''),
     path('getAllEventLocations/', views.GetAllEventLocationsView.as_view(), name=''),
-    path('getAllUserLocations/<str:id>/', views.GetAllUserLocationsView.as_view(), name='')
+    path('getAllUserLocations/<str:id>/', views.GetAllUserLocationsView.as_view(), name=''),
+    path('getNearbyEvents/<str:id>/', views.GetNearbyEventsView.as_view(), name=''),
+    path('getNearbyUsers/<str:id>/', views.GetNearbyUsersView.as_view(), name=''),
+    path('getMapClusters/', views.GetMapClustersView.as_view(), name=''),
+    path('search/<str:id>/', views.SearchView.as_view(), name=''),
+    path('async/sendMessage/', views.AsyncSendMessageView.as_view(), name=''),
+    path('async/getConversationMessages/<str:id>/', views.AsyncGetConversationMessagesView.as_view(), name=''),
+    path('async/pollMessages/<str:id>/', views.AsyncPollMessagesView.as_view(), name=''),
+    path('async/loadConversations/<str:id>/', views.AsyncLoadConversationsView.as_view(), name='')
 ]
@@ -1,10 +1,29 @@
-from datetime import datetime
+import asyncio
+import json
+from datetime import datetime, timedelta
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse
+from django.conf import settings
 from django.shortcuts import render
+from django.utils import timezone
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import generics, status
-from .models import Location, User, Message, Conversation, UserRefs, Event
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Count, FilteredRelation, Max, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from .models import Location, User, Message, Conversation, UserRefs, Event, ReadCursor
 from .serializers import UserSerializer, ConversationSerializer, MessageSerializer
+from .messaging import post_message, post_messages, mark_read
+from .broker import get_broker, conversation_channel
+from .renderers import CompactJSONRenderer
+from .cache import RESPONSE_TIMEOUT, bump_version, cached_response, get_profile, get_version, invalidate_profile
+from .conditional import aconditional_response, conditional_response
+from . import geo, clustering, feed, search, typeahead
 from django.contrib.auth import authenticate
 
 
@@ -16,6 +35,23 @@ class ListUsersView(generics.ListAPIView):
     def get_queryset(self):
         excluded_id = self.kwargs['id']
         return User.objects.exclude(id=excluded_id)
+
+
+class LookupUsersView(generics.ListAPIView):
+    """
+    Typeahead for picking users: ?q= matches the start of any word of a name, case and
+    accent insensitive. Users living near user `id` rank higher, at most `limit` are returned.
+    """
+    default_limit = 10
+    max_limit = 25
+
+    def list(self, request, *args, **kwargs):
+        limit = request.query_params.get("limit", str(self.default_limit))
+        if not self.kwargs['id'].isdigit() or not limit.isdigit():
+            return Response({"error": "id and limit must be positive integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        users = typeahead.lookup(self.kwargs['id'], request.query_params.get("q", ""), min(int(limit), self.max_limit))
+        return Response(users, status=status.HTTP_200_OK)
      
 class SendMessageView(generics.CreateAPIView):
     
@@ -36,41 +72,171 @@ class SendMessageView(generics.CreateAPIView):
             return Response({"error": "Invalid from_user_id or to_conversation_id."},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        # Create the Message instance
-        message = Message(content=content, from_user_id=from_user_id, to_conversation_id=to_conversation_id)
-        message.save()
+        # Create the Message instance and push it to anyone connected to the conversation
+        post_message(content, from_user_id, to_conversation_id)
 
         return Response(status=status.HTTP_201_CREATED)
 
 
+class SendMessagesView(generics.CreateAPIView):
+    max_batch_size = 500
+
+    def post(self, request, *args, **kwargs):
+        from_user_id = request.data.get("from_user_id")
+        messages = request.data.get("messages")  # List of {"to_conversation_id", "content"}
+
+        if not from_user_id or not isinstance(messages, list) or not messages:
+            return Response({"error": "from_user_id and a non-empty messages list are required fields."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(messages) > self.max_batch_size:
+            return Response({"error": f"At most {self.max_batch_size} messages can be sent at once."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            from_user = User.objects.get(id=from_user_id)
+        except (User.DoesNotExist, ValueError, TypeError):
+            return Response({"error": "Invalid from_user_id."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Validate every target at once: the sender must be a member of the conversation
+        conversation_ids = {str(item.get("to_conversation_id")) for item in messages if isinstance(item, dict)}
+        member_of = {str(conversation_id) for conversation_id in Conversation.users.through.objects.filter(
+            user_id=from_user.id, conversation_id__in=[c for c in conversation_ids if c.isdigit()]
+        ).values_list("conversation_id", flat=True)}
+
+        results, items = [], []
+        for index, item in enumerate(messages):
+            if not isinstance(item, dict) or not item.get("content") or not item.get("to_conversation_id"):
+                results.append({"index": index, "status": "error", "error": "content and to_conversation_id are required."})
+            elif str(item["to_conversation_id"]) not in member_of:
+                results.append({"index": index, "status": "error", "error": "Invalid to_conversation_id."})
+            else:
+                results.append({"index": index, "status": "created"})
+                items.append((index, int(item["to_conversation_id"]), item["content"]))
+
+        if items:
+            created = post_messages(from_user, [(conversation_id, content) for _, conversation_id, content in items])
+            for (index, _, _), message in zip(items, created):
+                results[index]["id"] = message.id
+
+        if len(items) == len(messages):
+            response_status = status.HTTP_201_CREATED
+        elif items:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({"results": results}, status=response_status)
+
+
+def invalid_message_params(query_params):
+    for param in ("after_id", "before_id", "limit"):
+        value = query_params.get(param)
+        if value is not None and not value.isdigit():
+            return f"{param} must be a positive integer."
+    return None
+
+
+def conversation_messages(conversation_id, query_params):
+    messages = Message.objects.filter(to_conversation_id=conversation_id)
+
+    # Incremental sync: only return messages newer than the last one the client has seen
+    after_id = query_params.get("after_id")
+    if after_id is not None:
+        return messages.filter(id__gt=after_id).order_by("id")
+
+    # Scroll-back: seek to the messages just before the oldest one the client has
+    before_id = query_params.get("before_id")
+    if before_id is not None:
+        anchor = Subquery(Message.objects.filter(id=before_id).values("timestamp")[:1])
+        messages = messages.filter(Q(timestamp__lt=anchor) | Q(timestamp=anchor, id__lt=before_id))
+
+    return messages.order_by("timestamp", "id")
+
+
+def message_page(messages, query_params, max_page_size):
+    """
+    Project `messages` straight into the response shape with one joined query.
+
+    Returns (messages, backwards). Pages are taken backwards from the newest message,
+    so when `backwards` is set the caller reverses them to return them oldest first.
+    """
+    messages = messages.values(
+        "id",
+        "content",
+        "from_user_id",
+        "to_conversation_id",
+        "timestamp",
+        sender_first_name=F("from_user_id__first_name"),
+    )
+
+    limit = query_params.get("limit")
+    if "after_id" not in query_params and (limit is not None or "before_id" in query_params):
+        limit = min(int(limit or max_page_size), max_page_size)
+        return messages.reverse()[:limit], True
+    return messages, False
+
+
+# Aggregates fingerprinting a conversation's messages, shared with the async view
+MESSAGES_VERSION = {"count": Count("id"), "last_id": Max("id")}
+
+
 class GetConversationMessagesView(generics.ListAPIView):
     serializer_class = MessageSerializer
+    max_page_size = 200
 
     def get_queryset(self):
-        conversation_id = self.kwargs['id']
-
-        return Message.objects.filter(to_conversation_id=conversation_id)    
+        return conversation_messages(self.kwargs['id'], self.request.query_params)
 
     def list(self, request, *args, **kwargs):
-        messages = self.get_queryset()
+        after_id = request.query_params.get("after_id")
+        error = invalid_message_params(request.query_params)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
 
-        res_messages = []
-        for message in messages:
+        # Incremental polls are already cheap and cursor-driven, everything else is
+        # fingerprinted first so unchanged conversations are answered with a 304
+        if after_id is not None:
+            return self.get_messages_response()
 
-            sender = User.objects.get(id=message.from_user_id.id)
-            print(sender.first_name)
+        version = Message.objects.filter(to_conversation_id=self.kwargs['id']).aggregate(**MESSAGES_VERSION)
+        return conditional_response(request, version.values(), self.get_messages_response)
+
+    def get_messages_response(self):
+        messages, backwards = message_page(self.get_queryset(), self.request.query_params, self.max_page_size)
+        messages = list(messages)
+        if backwards:
+            messages.reverse()
+        return Response(messages, status=status.HTTP_200_OK)
+
+def user_conversations(user_id):
+    # The user's conversations, each joined to the user's own read cursor
+    return Conversation.objects.filter(users__id=user_id).annotate(
+        cursor=FilteredRelation("read_cursors", condition=Q(read_cursors__user_id=user_id))
+    )
 
-            res_messages.append({
-                "content": message.content,
-                "from_user_id": message.from_user_id.id,
-                "to_conversation_id": message.to_conversation_id.id,
-                "timestamp": message.timestamp,
-                "sender_first_name": sender.first_name
-            })
-        
-        print(res_messages)
 
-        return Response(res_messages, status=status.HTTP_200_OK)
+def inbox(conversations):
+    # A single query sorted by recency, the preview comes from the denormalized last message
+    # and the unread count from the read cursor, so nothing is counted per conversation
+    return conversations.order_by(F("last_message_at").desc(nulls_last=True), "-id").values(
+        "id", "name", "last_message__content", "last_message_at",
+        unread_count=Coalesce("cursor__unread_count", 0), last_read_message_id=F("cursor__last_read_message_id"),
+    )
+
+
+def inbox_item(convo):
+    return {
+        'conversation_id': convo["id"],
+        'name': convo["name"],
+        'preview': convo["last_message__content"] if convo["last_message__content"] is not None else "No messages yet",
+        'timestamp': convo["last_message_at"],
+        'unread_count': convo["unread_count"],
+        'last_read_message_id': convo["last_read_message_id"],
+    }
+
+
+# The inbox only changes when a conversation is joined, gets a new message or is read
+INBOX_VERSION = {"count": Count("id"), "last_message_id": Max("last_message_id"), "read_at": Max("cursor__updated_at")}
+
 
 class LoadConversationsView(generics.ListAPIView):
     serializer_class = ConversationSerializer
@@ -78,33 +244,58 @@ class LoadConversationsView(generics.ListAPIView):
     def get_queryset(self):
         user_id = self.kwargs['id']
         # Filter conversations for the specific user
-        return Conversation.objects.filter(users__id=user_id)
+        return user_conversations(user_id)
 
     def list(self, request, *args, **kwargs):
-        # Call get_queryset() to get the filtered queryset
-        queryset = self.get_queryset()
+        version = self.get_queryset().aggregate(**INBOX_VERSION)
+        return conditional_response(request, version.values(), self.get_conversations_response)
 
-        conversations_data = []
+    def get_conversations_response(self):
+        conversations_data = [inbox_item(convo) for convo in inbox(self.get_queryset())]
 
-        # Loop through each conversation to add additional data (e.g., last message preview)
-        for convo in queryset:
-            # Retrieve the most recent message for each conversation
-            last_message = Message.objects.filter(to_conversation_id=convo.id).order_by('-timestamp').first()
-            
-            # Prepare the preview and timestamp for each conversation
-            preview = last_message.content if last_message else "No messages yet"
-            timestamp = last_message.timestamp if last_message else None
-
-            conversations_data.append({
-                'conversation_id': convo.id,
-                'name': convo.name,
-                'preview': preview,
-                'timestamp': timestamp
-            })
-        
         # Return the custom response with conversations data
         return Response(conversations_data, status=status.HTTP_200_OK)
 
+class MarkConversationReadView(generics.CreateAPIView):
+
+    def post(self, request, *args, **kwargs):
+        user_id = request.data.get("user_id")
+        conversation_id = request.data.get("conversation_id")
+        message_id = request.data.get("message_id")  # Optional, defaults to the newest message
+
+        if not user_id or not conversation_id:
+            return Response({"error": "user_id and conversation_id are required fields."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if message_id is not None and not str(message_id).isdigit():
+            return Response({"error": "message_id must be a positive integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            try:
+                cursor = ReadCursor.objects.select_for_update().select_related("conversation_id").get(
+                    user_id=user_id, conversation_id=conversation_id
+                )
+                if message_id is not None:
+                    message_id = Message.objects.values_list("id", flat=True).get(id=message_id, to_conversation_id=conversation_id)
+            except (ReadCursor.DoesNotExist, Message.DoesNotExist, ValueError, TypeError):
+                return Response({"error": "Invalid user_id, conversation_id or message_id."},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            cursor = mark_read(cursor, message_id)
+
+        return Response({"unread_count": cursor.unread_count, "last_read_message_id": cursor.last_read_message_id},
+                        status=status.HTTP_200_OK)
+
+
+class GetReadReceiptsView(generics.ListAPIView):
+
+    def list(self, request, *args, **kwargs):
+        # How far every member has read, clients mark a message read for those at or past it
+        receipts = ReadCursor.objects.filter(conversation_id=self.kwargs['id']).order_by("user_id").values(
+            "user_id", "last_read_message_id", first_name=F("user_id__first_name"), read_at=F("updated_at")
+        )
+        return Response(list(receipts), status=status.HTTP_200_OK)
+
+
 class CreateConversationView(generics.CreateAPIView):
     
     def post(self, request, *args, **kwargs):
@@ -134,8 +325,7 @@ class CreateConversationView(generics.CreateAPIView):
         conversation.users.add(from_user, *to_users)  # Add all users to the conversation
 
         # Create the message in the newly created conversation
-        message = Message(content=content, from_user_id=from_user, to_conversation_id=conversation)
-        message.save()
+        post_message(content, from_user, conversation)
 
         return Response(status=status.HTTP_201_CREATED)        
         
@@ -165,13 +355,43 @@ class SetUserLocationView(generics.ListAPIView):
             return Response({"error": "Invalid from_user_id"}, status=status.HTTP_400_BAD_REQUEST)
 
                 
-        location = Location(city=city, country=country, region=region, latitude=latitude, longitude=longitude, latitude_delta=latitude_delta, longitude_delta=longitude_delta)
-        location.save()
-        
-        userRefs = UserRefs(user_id=user_id, location_id=location)
-        userRefs.save()
+        fields = {"city": city, "country": country, "region": region, "latitude": latitude, "longitude": longitude,
+                  "latitude_delta": latitude_delta, "longitude_delta": longitude_delta}
+
+        try:
+            moved = self.save_home(user_id, fields)
+        except IntegrityError:
+            # A concurrent first request created the home in between, update it instead
+            moved = self.save_home(user_id, fields)
+
+        invalidate_profile(user_id.id)
+        if moved:
+            bump_version("events")
         
         return Response(status=status.HTTP_201_CREATED)
+
+    def save_home(self, user, fields):
+        # Upsert the user's single home, moving updates its Location in place.
+        # Returns whether the user moved.
+        with transaction.atomic():
+            userRefs = UserRefs.objects.current().select_for_update().select_related("location_id").filter(user_id=user).first()
+            if userRefs is None:
+                location = Location.objects.create(**fields)
+                UserRefs.objects.create(user_id=user, location_id=location, is_current=True)
+                moved = True
+            else:
+                location = userRefs.location_id
+                moved = (location.latitude, location.longitude) != (float(fields["latitude"]), float(fields["longitude"]))
+                for field, value in fields.items():
+                    setattr(location, field, value)
+                location.save()
+                # Touch updated_at, the user locations fingerprint relies on it
+                userRefs.save(update_fields=["updated_at"])
+
+            # Nearby events depend on where the user lives
+            if moved:
+                feed.rebuild_user(user.id, location)
+        return moved
         
 
 class LoginView(generics.ListAPIView):
@@ -220,59 +440,71 @@ class CreateEventView(generics.CreateAPIView):
                             status=status.HTTP_400_BAD_REQUEST) 
         
         date = datetime.fromisoformat(date.replace("Z", "+00:00"))
+        if timezone.is_naive(date):
+            date = timezone.make_aware(date)
         location = Location(city=city, country=country, region=region, latitude=latitude, longitude=longitude, latitude_delta=0, longitude_delta=0)
         location.save()
         event = Event.objects.create(owner_id=owner_id, date=date, name=event_name, description=description, location_id=location)
+        feed.add_event(event)
 
         return Response(status=status.HTTP_201_CREATED)
 
+HOME_FIELDS = ("city", "country", "region", "latitude", "longitude", "latitude_delta", "longitude_delta")
+
+# Shown for users who have not set a home yet
+DEFAULT_HOME = {
+    "city": "Toronto",
+    "country": "Canada",
+    "region": "Ontario",
+    "latitude": 43.77345349999999,
+    "longitude": -79.50186839999999,
+    "latitude_delta": 0.1,
+    "longitude_delta": 0.1
+}
+
+
+def with_home(users):
+    """Left join each user's current home, its location fields are exposed as home_<field>."""
+    return users.annotate(
+        home=FilteredRelation("userrefs", condition=Q(userrefs__is_current=True)),
+        **{f"home_{field}": F(f"home__location_id__{field}") for field in HOME_FIELDS},
+    )
+
+
 class GetUserInfoView(generics.ListAPIView):
 
     def get_queryset(self):
         user_id = self.kwargs['id']
-        # Filter conversations for the specific user
-        return User.objects.get(id=user_id)
+        return with_home(User.objects.filter(id=user_id))
 
     def list(self, request, *args, **kwargs):
-        # Call get_queryset() to get the filtered queryset
-        user = self.get_queryset()
-
-        location = UserRefs.objects.filter(user_id=user).first()
-       
-        if location is None:
-            user_info = {
-            "user_id": user.id,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "email": user.email,
-            "city": "Toronto",
-            "country": "Canada",
-            "region": "Ontario",
-            "latitude": 43.77345349999999,
-            "longitude": -79.50186839999999,
-            "latitude_delta": 0.1,
-            "longitude_delta": 0.1
-        }
-        else:
-            location = UserRefs.objects.filter(user_id=user).first().location_id
-            
-            user_info = {
-            "user_id": user.id,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "email": user.email,
-            "city": location.city,
-            "country": location.country,
-            "region": location.region,
-            "latitude": location.latitude,
-            "longitude": location.longitude,
-            "latitude_delta": location.latitude_delta,
-            "longitude_delta": location.longitude_delta
-        }
-            
+        # Profiles are read on every screen, so they are cached until the user or their home changes
+        user_info = get_profile(self.kwargs['id'], self.get_user_info)
+        if user_info is None:
+            return Response({"error": "Invalid user_id"}, status=status.HTTP_400_BAD_REQUEST)
 
         # Return the custom response with conversations data
         return Response(user_info, status=status.HTTP_200_OK)
+
+    def get_user_info(self):
+        user = self.get_queryset().values(
+            "id", "first_name", "last_name", "email", *(f"home_{field}" for field in HOME_FIELDS)
+        ).first()
+        if user is None:
+            return None
+
+        if user["home_latitude"] is None:
+            home = DEFAULT_HOME
+        else:
+            home = {field: user[f"home_{field}"] for field in HOME_FIELDS}
+
+        return {
+            "user_id": user["id"],
+            "first_name": user["first_name"],
+            "last_name": user["last_name"],
+            "email": user["email"],
+            **home
+        }
     
 class JoinEventView(generics.CreateAPIView):
     
@@ -290,59 +522,233 @@ class JoinEventView(generics.CreateAPIView):
             return Response({"error": "Invalid event or user_id"},
                             status=status.HTTP_400_BAD_REQUEST) 
             
+        # api.signals takes the event out of the user's feed
         event.users.add(user_id)
         
         return Response({"message": "User added to event successfully"},
                         status=status.HTTP_200_OK)
 
+
+class BatchEventMembersView(generics.CreateAPIView):
+    """Shared validation for the endpoints that change many attendees of one event at once."""
+    max_batch_size = 1000
+
+    def get_user_ids(self, data):
+        return data.get("user_ids")
+
+    def post(self, request, *args, **kwargs):
+        event_id = request.data.get("event_id")
+        user_ids = self.get_user_ids(request.data)
+
+        if not event_id or not isinstance(user_ids, list) or not user_ids:
+            return Response({"error": "event_id and a non-empty user_ids list are required fields."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(user_ids) > self.max_batch_size:
+            return Response({"error": f"At most {self.max_batch_size} users can be changed at once."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            event = Event.objects.get(id=event_id)
+        except (Event.DoesNotExist, ValueError, TypeError):
+            return Response({"error": "Invalid event_id"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # One query validates every id
+        requested = {str(user_id) for user_id in user_ids}
+        valid = set(User.objects.filter(id__in=[u for u in requested if u.isdigit()]).values_list("id", flat=True))
+        invalid = sorted(requested - {str(user_id) for user_id in valid})
+
+        result = self.apply(event, valid)
+        # Through-table bulk writes bypass m2m_changed, so cached event listings are invalidated
+        # here and apply() updates the feeds itself
+        bump_version("events")
+
+        return Response({**result, "invalid_user_ids": invalid}, status=status.HTTP_200_OK)
+
+
+class BatchJoinEventView(BatchEventMembersView):
+
+    def apply(self, event, user_ids):
+        Attendee = Event.users.through
+        already_joined = set(Attendee.objects.filter(event_id=event.id, user_id__in=user_ids).values_list("user_id", flat=True))
+        Attendee.objects.bulk_create(
+            [Attendee(event_id=event.id, user_id=user_id) for user_id in user_ids],
+            ignore_conflicts=True,
+        )
+        feed.remove_event(event, user_ids)
+        return {"added": sorted(user_ids - already_joined), "already_joined": sorted(already_joined)}
+
+
+class BatchLeaveEventView(BatchEventMembersView):
+
+    def apply(self, event, user_ids):
+        Attendee = Event.users.through
+        removed = Attendee.objects.filter(event_id=event.id, user_id__in=user_ids)
+        removed_ids = sorted(removed.values_list("user_id", flat=True))
+        removed.delete()
+        feed.add_event(event, removed_ids)
+        return {"removed": removed_ids}
+
+
+class InviteToEventView(BatchJoinEventView):
+    # Invite explicit users, or every member of a conversation with conversation_id
+
+    def get_user_ids(self, data):
+        conversation_id = data.get("conversation_id")
+        if conversation_id is None:
+            return data.get("user_ids")
+        if not str(conversation_id).isdigit():
+            return None
+        return list(Conversation.users.through.objects.filter(conversation_id=conversation_id).values_list("user_id", flat=True))
+
+def with_attendees(events, names=True):
+    """
+    Join each event's location and owner and count its attendees in the same query.
+
+    Attendee first names are batch-loaded in one extra query unless only the count is wanted.
+    """
+    attendee_count = Event.users.through.objects.filter(event_id=OuterRef("pk")).values("event_id").annotate(
+        count=Count("*")
+    ).values("count")
+    events = events.select_related("location_id", "owner_id").annotate(
+        attendee_count=Coalesce(Subquery(attendee_count), 0)
+    )
+    if names:
+        events = events.prefetch_related(Prefetch("users", queryset=User.objects.only("first_name")))
+    return events
+
+
+def upcoming_window(query_params):
+    """
+    (start, end) dates of the events to list: upcoming ones up to horizon_days ahead.
+
+    start is now rounded down to the response cache timeout, so it only changes when cached
+    responses would expire anyway and can be part of their key. Raises ValueError for a bad
+    horizon_days.
+    """
+    horizon_days = query_params.get("horizon_days", str(settings.EVENT_HORIZON_DAYS))
+    if not horizon_days.isdigit():
+        raise ValueError("horizon_days must be a positive integer")
+
+    now = timezone.now()
+    start = now - timedelta(seconds=now.timestamp() % RESPONSE_TIMEOUT)
+    return start, now + timedelta(days=min(int(horizon_days), settings.EVENT_HORIZON_DAYS))
+
+
 class GetAvailableEventsView(generics.ListAPIView):
+    """
+    Upcoming events near the user's home that they haven't joined, soonest first.
+
+    Read from the feed maintained by api.feed and paged with limit and after_id (the id of
+    the last event already seen). Users without a home get every upcoming event instead.
+    horizon_days limits how far ahead events are listed, see upcoming_window().
+    """
+    default_limit = 50
+    max_limit = 200
 
     def get_queryset(self):
         user_id = self.kwargs['id']
-        return Event.objects.exclude(users__id=user_id)
-    
+        after_id = self.request.query_params.get("after_id")
+        start, end = self.window
+
+        if UserRefs.objects.current().filter(user_id=user_id).exists():
+            events, date = Event.objects.all(), "feed_entries__date"
+            condition = Q(feed_entries__user_id=user_id, feed_entries__date__range=(start, end))
+        else:
+            events, date = Event.objects.exclude(users__id=user_id), "date"
+            condition = Q(date__range=(start, end))
+
+        if after_id is not None:
+            anchor = Subquery(Event.objects.filter(id=after_id).values("date")[:1])
+            condition &= Q(**{f"{date}__gt": anchor}) | Q(**{date: anchor, "id__gt": after_id})
+
+        # A single filter() so every condition applies to the same feed entry
+        return events.filter(condition).order_by(date, "id")
+
     def list(self, request, *args, **kwargs):
-        events = self.get_queryset()
+        for param in ("after_id", "limit"):
+            value = request.query_params.get(param)
+            if value is not None and not value.isdigit():
+                return Response({"error": f"{param} must be a positive integer."},
+                                status=status.HTTP_400_BAD_REQUEST)
+        try:
+            self.window = upcoming_window(request.query_params)
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Events change rarely, so responses are cached until the next event write
+        return cached_response(request, "events", self.get_events_info, key_parts=[int(self.window[0].timestamp())])
+
+    def get_events_info(self):
+        # ?attendees=count skips loading the attendee names
+        names = self.request.query_params.get("attendees") != "count"
+        limit = min(int(self.request.query_params.get("limit", self.default_limit)), self.max_limit)
+        events = with_attendees(self.get_queryset(), names=names)[:limit]
 
         events_info = []
 
         for event in events:
-            location = Location.objects.get(id=event.location_id.id)
-            owner = User.objects.get(id=event.owner_id.id)
+            location = event.location_id
+            owner = event.owner_id
 
-            events_info.append({
+            event_info = {
                 "event_id": event.id,
                 "owner_first_name": owner.first_name,
                 "owner_last_name": owner.last_name,
                 "name": event.name,
                 "description": event.description,
                 "date": event.date,
-                "users": [atendee.first_name for atendee in event.users.all()],
+                "attendee_count": event.attendee_count,
                 "city": location.city,
                 "region": location.region,
                 "country": location.country,
-            })
+            }
+            if names:
+                event_info["users"] = [atendee.first_name for atendee in event.users.all()]
+            events_info.append(event_info)
 
-        return Response(events_info, status=status.HTTP_200_OK)
+        return events_info
 
 class GetAllEventLocationsView(generics.ListAPIView):
     queryset = ""
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, CompactJSONRenderer]
     
     def list(self, request, *args, **kwargs):
-        events = Event.objects.all()
-        
+        # Only return the events inside the map viewport when one is given
+        try:
+            viewport = geo.viewport_from_params(request.query_params)
+        except ValueError:
+            return Response({"error": "Invalid viewport"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            window = upcoming_window(request.query_params)
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Events change rarely, so responses are cached until the next event write
+        return cached_response(request, "events", lambda: self.get_event_locations(viewport, window),
+                               key_parts=[int(window[0].timestamp())])
+
+    def get_event_locations(self, viewport, window):
+        # Upcoming events only, past ones are moved out by the archive_past_events command
+        events = Event.objects.filter(date__range=window)
+        if viewport is not None:
+            events = events.filter(geo.bbox_filter(*viewport, prefix="location_id__"))
+
+        # ?attendees=count skips loading the attendee names
+        names = self.request.query_params.get("attendees") != "count"
+        events = with_attendees(events, names=names)
+
         event_locations = []
         for event in events:
-            location = Location.objects.get(id=event.location_id.id)
-            owner = User.objects.get(id=event.owner_id.id)
-            event_locations.append({
+            location = event.location_id
+            owner = event.owner_id
+            event_location = {
                 "event_id": event.id,
                 "event_name": event.name,
                 "date": event.date,
                 "description": event.description,
                 "owner_first_name": owner.first_name,
                 "owner_last_name": owner.last_name,
-                "users": [atendee.first_name for atendee in event.users.all()],
+                "attendee_count": event.attendee_count,
                 "city": location.city,
                 "country": location.country,
                 "region": location.region,
@@ -350,42 +756,341 @@ class GetAllEventLocationsView(generics.ListAPIView):
                 "longitude": location.longitude,
                 "latitude_delta": location.latitude_delta,
                 "longitude_delta": location.longitude_delta
-            })
+            }
+            if names:
+                event_location["users"] = [atendee.first_name for atendee in event.users.all()]
+            event_locations.append(event_location)
         
-        return Response(event_locations, status=status.HTTP_200_OK)    
+        return event_locations
 
 
 class GetAllUserLocationsView(generics.ListAPIView):
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, CompactJSONRenderer]
 
     def get_queryset(self):
         user_id = self.kwargs['id']
         return User.objects.exclude(id=user_id)
     
     def list(self, request, *args, **kwargs):
-        users = self.get_queryset()
+        # api.signals bumps the "users" version on new users, renames and home changes,
+        # so unchanged listings are answered without touching the database
+        return conditional_response(request, (get_version("users"),), self.get_user_locations_response)
+
+    def get_user_locations_response(self):
+        # One join of every other user with their current home
+        users = with_home(self.get_queryset()).values(
+            "id", "first_name", "last_name", *(f"home_{field}" for field in HOME_FIELDS)
+        )
 
         user_locations = []
         for user in users:
-            
-            userRef = UserRefs.objects.filter(user_id=user.id).first()
-            if not userRef: # the user does not have an assigned location
+            if user["home_latitude"] is None: # the user does not have an assigned location
                 return Response({"error":"There is a user who is not assigned a home."}, status=status.HTTP_400_BAD_REQUEST)
 
-            location = Location.objects.get(id=userRef.location_id.id)
-
             user_locations.append({
-                "user_id": user.id,
-                "owner_first_name": user.first_name,
-                "owner_last_name": user.last_name,
+                "user_id": user["id"],
+                "owner_first_name": user["first_name"],
+                "owner_last_name": user["last_name"],
+                **{field: user[f"home_{field}"] for field in HOME_FIELDS}
+            })
+
+        return Response(user_locations, status=status.HTTP_200_OK)
+
+
+class NearbyMixin:
+    default_radius_km = 25
+    max_radius_km = 500
+    default_limit = 50
+    max_limit = 200
+
+    def get_home_location(self):
+        user_ref = UserRefs.objects.current().filter(user_id=self.kwargs['id']).select_related("location_id").first()
+        return user_ref.location_id if user_ref else None
+
+    def get_search_params(self):
+        # radius_km bounds the search, limit turns it into a k-nearest query
+        radius_km = float(self.request.query_params.get("radius_km", self.default_radius_km))
+        limit = int(self.request.query_params.get("limit", self.default_limit))
+        if not 0 < radius_km <= self.max_radius_km or not 0 < limit <= self.max_limit:
+            raise ValueError("radius_km or limit out of range")
+        return radius_km, limit
+
+    def list(self, request, *args, **kwargs):
+        try:
+            radius_km, limit = self.get_search_params()
+        except ValueError:
+            return Response({"error": f"radius_km must be in (0, {self.max_radius_km}] and limit in [1, {self.max_limit}]"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        home = self.get_home_location()
+        if home is None:
+            return Response({"error": "This user is not assigned a home."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(self.get_nearby(home, radius_km, limit), status=status.HTTP_200_OK)
+
+
+class GetNearbyEventsView(NearbyMixin, generics.ListAPIView):
+
+    def get_queryset(self):
+        user_id = self.kwargs['id']
+        # Past events are no longer worth going to, however close they are
+        return Event.objects.filter(date__gte=timezone.now()).exclude(users__id=user_id)
+
+    def get_nearby(self, home, radius_km, limit):
+        matches = geo.nearest(self.get_queryset(), home.latitude, home.longitude, radius_km, limit,
+                              prefix="location_id__", fields=("id",))
+        events = with_attendees(Event.objects.all()).in_bulk(
+            [row["id"] for _, row in matches]
+        )
+
+        events_info = []
+        for distance, row in matches:
+            event = events[row["id"]]
+            location = event.location_id
+            events_info.append({
+                "event_id": event.id,
+                "owner_first_name": event.owner_id.first_name,
+                "owner_last_name": event.owner_id.last_name,
+                "name": event.name,
+                "description": event.description,
+                "date": event.date,
+                "attendee_count": event.attendee_count,
+                "users": [atendee.first_name for atendee in event.users.all()],
                 "city": location.city,
-                "country": location.country,
                 "region": location.region,
+                "country": location.country,
                 "latitude": location.latitude,
                 "longitude": location.longitude,
-                "latitude_delta": location.latitude_delta,
-                "longitude_delta": location.longitude_delta
+                "distance_km": round(distance, 3),
             })
 
-        return Response(user_locations, status=status.HTTP_200_OK)
-        
-        
+        return events_info
+
+
+class GetNearbyUsersView(NearbyMixin, generics.ListAPIView):
+
+    def get_queryset(self):
+        user_id = self.kwargs['id']
+        return UserRefs.objects.current().exclude(user_id=user_id)
+
+    def get_nearby(self, home, radius_km, limit):
+        matches = geo.nearest(self.get_queryset(), home.latitude, home.longitude, radius_km, limit,
+                              prefix="location_id__", fields=(
+                                  "user_id", "user_id__first_name", "user_id__last_name",
+                                  "location_id__city", "location_id__country", "location_id__region",
+                              ))
+
+        return [{
+            "user_id": row["user_id"],
+            "owner_first_name": row["user_id__first_name"],
+            "owner_last_name": row["user_id__last_name"],
+            "city": row["location_id__city"],
+            "country": row["location_id__country"],
+            "region": row["location_id__region"],
+            "latitude": row["location_id__latitude"],
+            "longitude": row["location_id__longitude"],
+            "distance_km": round(distance, 3),
+        } for distance, row in matches]
+
+
+class GetMapClustersView(generics.ListAPIView):
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, CompactJSONRenderer]
+
+    def list(self, request, *args, **kwargs):
+        layer = request.query_params.get("layer", "events")
+        zoom = request.query_params.get("zoom", "")
+        if layer not in ("events", "users") or not zoom.isdigit() or int(zoom) > clustering.MAX_ZOOM:
+            return Response({"error": f"layer must be events or users and zoom in [0, {clustering.MAX_ZOOM}]"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            viewport = geo.viewport_from_params(request.query_params)
+        except ValueError:
+            viewport = None
+        if viewport is None:
+            return Response({"error": "Invalid viewport"}, status=status.HTTP_400_BAD_REQUEST)
+
+        key_parts = ()
+        if layer == "events":
+            # The same upcoming events as getAllEventLocations, tiles are keyed by the window
+            try:
+                window = upcoming_window(request.query_params)
+            except ValueError as error:
+                return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = Event.objects.filter(date__range=window)
+            key_parts = (int(window[0].timestamp()), (window[1] - window[0]).days)
+        else:
+            queryset = UserRefs.objects.current()
+
+        clusters = clustering.clusters(layer, queryset, int(zoom), viewport, prefix="location_id__", key_parts=key_parts)
+        if clusters is None:
+            return Response({"error": "Viewport is too large for this zoom level"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(clusters, status=status.HTTP_200_OK)
+
+
+class SearchView(generics.ListAPIView):
+    """
+    Full-text search on behalf of user `id`: ?q=...&type=messages|events|users.
+
+    Every word matches as a prefix, results are ranked and paged with limit and offset.
+    Messages are limited to the conversations the user is a member of.
+    """
+    default_limit = 20
+    max_limit = 100
+
+    def list(self, request, *args, **kwargs):
+        words = search.query_words(request.query_params.get("q"))
+        kind = request.query_params.get("type", "messages")
+        limit = request.query_params.get("limit", str(self.default_limit))
+        offset = request.query_params.get("offset", "0")
+
+        if not words or kind not in ("messages", "events", "users"):
+            return Response({"error": "q must contain a word and type be one of messages, events or users."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not limit.isdigit() or not offset.isdigit():
+            return Response({"error": "limit and offset must be positive integers."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        limit, offset = min(int(limit), self.max_limit), int(offset)
+
+        if kind == "messages":
+            hits = search.search_messages(self.kwargs['id'], words, limit, offset)
+        elif kind == "events":
+            hits = search.search_events(words, limit, offset)
+        else:
+            hits = search.search_users(words, limit, offset)
+
+        return Response(hits, status=status.HTTP_200_OK)
+
+# Async variants of the chat endpoints. Under CHD.asgi they await the database instead of
+# holding a worker thread for the whole request, so one process can serve thousands of
+# polling clients. They take the same parameters and return the same bodies as the views above.
+
+def json_response(data, status=status.HTTP_200_OK):
+    # DRF's encoder so timestamps are formatted exactly like the sync views
+    return JsonResponse(data, encoder=JSONEncoder, safe=False, status=status)
+
+
+class AsyncAPIView(View):
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Like DRF's APIView, clients authenticate without CSRF tokens
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    def get_data(self, request):
+        # Raises ValueError unless the body is a form or a JSON object
+        if request.content_type == "application/json":
+            data = json.loads(request.body or b"{}")
+            if not isinstance(data, dict):
+                raise ValueError("Expected a JSON object")
+            return data
+        return request.POST
+
+
+class AsyncSendMessageView(AsyncAPIView):
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            data = self.get_data(request)
+        except ValueError:
+            return json_response({"error": "The body must be a JSON object."}, status=status.HTTP_400_BAD_REQUEST)
+
+        content = data.get("content")
+        from_user_id = data.get("from_user_id")
+        to_conversation_id = data.get("to_conversation_id")
+
+        if not content or not from_user_id or not to_conversation_id:
+            return json_response({"error": "content, from_user_id, and to_conversation_id are required fields."},
+                                 status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            from_user = await User.objects.aget(id=from_user_id)
+            conversation = await Conversation.objects.aget(id=to_conversation_id)
+        except (User.DoesNotExist, Conversation.DoesNotExist, ValueError, TypeError):
+            return json_response({"error": "Invalid from_user_id or to_conversation_id."},
+                                 status=status.HTTP_400_BAD_REQUEST)
+
+        # The insert and the conversation pointer share a transaction, which has to run in sync code
+        await sync_to_async(post_message)(content, from_user, conversation)
+
+        return HttpResponse(status=status.HTTP_201_CREATED)
+
+
+class AsyncGetConversationMessagesView(AsyncAPIView):
+    max_page_size = GetConversationMessagesView.max_page_size
+
+    async def get(self, request, id):
+        error = invalid_message_params(request.GET)
+        if error:
+            return json_response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        if request.GET.get("after_id") is not None:
+            return await self.get_messages_response(request, id)
+
+        # Same fingerprint and 304s as GetConversationMessagesView
+        version = await Message.objects.filter(to_conversation_id=id).aaggregate(**MESSAGES_VERSION)
+        return await aconditional_response(request, version.values(), lambda: self.get_messages_response(request, id))
+
+    async def get_messages_response(self, request, id):
+        messages, backwards = message_page(conversation_messages(id, request.GET), request.GET, self.max_page_size)
+        messages = [message async for message in messages]
+        if backwards:
+            messages.reverse()
+        return json_response(messages)
+
+
+class AsyncPollMessagesView(AsyncAPIView):
+    """
+    Long-poll for clients that cannot hold a websocket.
+
+    Answers as soon as the conversation has messages newer than after_id, woken by the
+    message broker rather than by polling the database, or with an empty list once
+    `timeout` seconds have passed.
+    """
+    default_timeout = 25
+    max_timeout = 55
+
+    async def get(self, request, id):
+        after_id = request.GET.get("after_id", "")
+        timeout = request.GET.get("timeout", str(self.default_timeout))
+        if not id.isdigit() or not after_id.isdigit() or not timeout.isdigit():
+            return json_response({"error": "after_id is required, after_id and timeout must be positive integers."},
+                                 status=status.HTTP_400_BAD_REQUEST)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + min(int(timeout), self.max_timeout)
+
+        # Subscribe before looking, so a message committed in between still wakes us up
+        subscription = get_broker().subscribe(conversation_channel(int(id)))
+        try:
+            messages = await self.get_messages(id, after_id)
+            if not messages and not await Conversation.objects.filter(id=id).aexists():
+                return json_response({"error": "Invalid conversation id."}, status=status.HTTP_400_BAD_REQUEST)
+
+            while not messages and loop.time() < deadline:
+                try:
+                    await asyncio.wait_for(subscription.get(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+                messages = await self.get_messages(id, after_id)
+        finally:
+            subscription.close()
+
+        return json_response(messages)
+
+    async def get_messages(self, conversation_id, after_id):
+        query_params = {"after_id": after_id}
+        messages, _ = message_page(conversation_messages(conversation_id, query_params), query_params, None)
+        return [message async for message in messages]
+
+
+class AsyncLoadConversationsView(AsyncAPIView):
+
+    async def get(self, request, id):
+        version = await user_conversations(id).aaggregate(**INBOX_VERSION)
+        return await aconditional_response(request, version.values(), lambda: self.get_conversations_response(id))
+
+    async def get_conversations_response(self, id):
+        conversations = inbox(user_conversations(id))
+        return json_response([inbox_item(convo) async for convo in conversations])